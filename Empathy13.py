@@ -1,68 +1,415 @@
 # Standard libraries
 import os
 import time
+import ast
+import mmap
+import atexit
+import struct
+import math
+import audioop
+import hashlib
+import gzip
+import shutil
+import sqlite3
+import copy
 import re
 import json
+import random
+import queue
+import asyncio
+import threading
+import subprocess
+import sys
+import tempfile
+import uuid
+import argparse
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # Third-party libraries
 import pyttsx3
 import openai
 import speech_recognition as sr
 import requests
+from requests.adapters import HTTPAdapter
 
 # Bottle imports
 from bottle import Bottle, request, response, run
 
+# Optional exact tokenizer for context budgeting
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
-# Ensure OpenAI API Key is set
-openai.api_key = os.getenv("OPENAI_API_KEY")
-if not openai.api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set.")
+# Optional vectorized audio analysis
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Optional offline speech recognition engine
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+# Optional asyncio serving stack
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:
+    aiohttp = None
+    web = None
+
+
+# Ensure OpenAI API Key is set before OpenAI is first called
+def require_openai_key():
+    """
+    Raises if no OpenAI API key is configured. Checked on first use rather
+    than at import so modes that never call OpenAI can start without one.
+    """
+    if not openai.api_key:
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+    if not openai.api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set.")
 
 # Replace with your Bot Libre application ID and bot ID
 application_id = '5657790313173565017'
 bot_id = '56113914'
 
-# Initialize speech recognition and text-to-speech
-recognizer = sr.Recognizer()
-engine = pyttsx3.init()
+# Deferred construction of expensive subsystems
+class LazyResource:
+    """
+    Stands in for an object that is expensive to create (audio drivers,
+    parsed knowledge bases) and builds it with factory() on first attribute
+    access. Server and text modes therefore never pay for, or fail on,
+    subsystems they do not use. Construction time is kept for /stats.
+    """
+    def __init__(self, name, factory):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_target", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+        object.__setattr__(self, "init_seconds", None)
+
+    def resolve(self):
+        """
+        Returns the underlying object, creating it on the first call.
+        """
+        target = object.__getattribute__(self, "_target")
+        if target is None:
+            with object.__getattribute__(self, "_lock"):
+                target = object.__getattribute__(self, "_target")
+                if target is None:
+                    start = time.perf_counter()
+                    target = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "init_seconds", time.perf_counter() - start)
+                    object.__setattr__(self, "_target", target)
+        return target
+
+    @property
+    def initialized(self):
+        return object.__getattribute__(self, "_target") is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.resolve(), attr, value)
+
+    def __repr__(self):
+        state = "initialized" if self.initialized else "not initialized"
+        return f"<LazyResource {object.__getattribute__(self, '_name')} ({state})>"
+
+# Text-to-speech settings
+SPEECH_RATE = 150  # Normal speech rate
+SLOW_SPEECH_RATE = 120  # Slower rate for sensitive content
 
 # Configuration for text-to-speech engine
-def configure_tts():
+def configure_tts(tts_engine=None):
     """
     Configure the text-to-speech engine for Amie's voice settings.
     Sets the voice to a female tone and adjusts the rate and volume.
     """
-    voices = engine.getProperty("voices")
+    tts_engine = tts_engine or engine
+    voices = tts_engine.getProperty("voices")
     for voice in voices:
         if "female" in voice.name.lower():  # Look for a female voice
-            engine.setProperty("voice", voice.id)
+            tts_engine.setProperty("voice", voice.id)
             break
-    engine.setProperty("rate", 150)  # Normal speech rate
-    engine.setProperty("volume", 1.0)  # Maximum volume
+    tts_engine.setProperty("rate", SPEECH_RATE)  # Normal speech rate
+    tts_engine.setProperty("volume", 1.0)  # Maximum volume
+
+# Start the text-to-speech driver and apply Amie's voice settings
+def create_tts_engine():
+    tts_engine = pyttsx3.init()
+    configure_tts(tts_engine)
+    return tts_engine
+
+# Speech recognition and text-to-speech, initialized on first use
+recognizer = LazyResource("recognizer", sr.Recognizer)
+engine = LazyResource("tts_engine", create_tts_engine)
+
+# Bot Libre connection settings
+BOTLIBRE_URL = 'https://www.botlibre.com/rest/json/chat'
+BOTLIBRE_CONNECT_TIMEOUT = 3.05  # Seconds to establish a connection
+BOTLIBRE_READ_TIMEOUT = 10  # Seconds to wait for a reply
+BOTLIBRE_MAX_RETRIES = 2  # Extra attempts after the first one
+BOTLIBRE_BACKOFF = 0.25  # Base delay (seconds) for retry backoff
+BOTLIBRE_POOL_SIZE = 10  # Keep-alive connections kept open per host
+ASYNC_UPSTREAM_CONNECTIONS = 200  # Concurrent upstream connections in async server mode
+
+# Reusable Bot Libre client with a keep-alive connection pool
+class BotLibreClient:
+    """
+    Talks to Bot Libre over a persistent HTTP session so each message reuses
+    an open connection instead of paying a new TCP+TLS handshake.
+    Every call has connect/read timeouts, a bounded number of jittered retries
+    and records its latency.
+    """
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, url=BOTLIBRE_URL, application=application_id, instance=bot_id,
+                 timeout=(BOTLIBRE_CONNECT_TIMEOUT, BOTLIBRE_READ_TIMEOUT),
+                 max_retries=BOTLIBRE_MAX_RETRIES, backoff=BOTLIBRE_BACKOFF,
+                 pool_size=BOTLIBRE_POOL_SIZE):
+        self.url = url
+        self.application = application
+        self.instance = instance
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.session = self._create_session()
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def _create_session(self):
+        """
+        Creates the HTTP session whose connection pool is reused across calls.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _record(self, latency, retries, failed):
+        """
+        Updates the latency and error counters for one call.
+        """
+        with self.lock:
+            self.calls += 1
+            self.retries += retries
+            self.errors += 1 if failed else 0
+            self.total_latency += latency
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def send_message(self, message):
+        """
+        Sends a message to Bot Libre and returns its reply.
+        Errors are returned as text, matching the original helper's contract.
+        """
+        payload = {
+            'application': self.application,
+            'instance': self.instance,
+            'message': message
+        }
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+                if response.status_code == 200:
+                    self._record(time.perf_counter() - start, attempt, False)
+                    return response.json().get('message')
+                if response.status_code not in self.RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    self._record(time.perf_counter() - start, attempt, True)
+                    return f"Error: Unable to communicate with Bot Libre (Status Code: {response.status_code})"
+            except requests.exceptions.RequestException as e:
+                if attempt >= self.max_retries:
+                    self._record(time.perf_counter() - start, attempt, True)
+                    return f"Error: {str(e)}"
+            # Exponential backoff with full jitter so retries don't stampede the upstream
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+            attempt += 1
+
+    def stats(self):
+        """
+        Reports call counts and latency for the Bot Libre upstream.
+        """
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "errors": self.errors,
+                "avg_latency_ms": 1000 * self.total_latency / self.calls if self.calls else 0.0,
+                "last_latency_ms": 1000 * self.last_latency,
+                "max_latency_ms": 1000 * self.max_latency,
+            }
 
-# Call TTS configuration during initialization
-configure_tts()
+# Shared client used by generate_response and the /chat API
+botlibre_client = BotLibreClient()
 
 # Function to communicate with Bot Libre
 def send_message_to_botlibre(message):
     """
     Sends a message to the Bot Libre chatbot and retrieves the response.
     """
-    url = 'https://www.botlibre.com/rest/json/chat'
-    payload = {
-        'application': application_id,
-        'instance': bot_id,
-        'message': message
-    }
+    return botlibre_client.send_message(message)
+
+# Local AIML knowledge base shipped alongside this script
+AIML_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "empathy13AIML.xml")
+
+# In-process AIML engine (Graphmaster-style pattern trie)
+class AIMLGraphmaster:
+    """
+    Compiles AIML categories into an in-memory word trie so matching inputs
+    can be answered locally without a network round-trip.
+    Supports the `*` and `_` wildcards and <star/> substitution in templates.
+    """
+    WILDCARDS = ("_", "*")
+
+    def __init__(self):
+        self.root = {}
+        self.category_count = 0
+        self.lock = threading.Lock()  # Guards the counters; matching itself only reads the trie
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text):
+        """
+        Splits text into words the way patterns are written: uppercase,
+        curly apostrophes straightened and other punctuation removed.
+        Returns (pattern_words, original_words) so stars keep the user's spelling.
+        """
+        text = text.replace("\u2019", "'")
+        words = re.findall(r"[\w']+", text)
+        return [w.upper() for w in words], words
+
+    def add_category(self, pattern, template):
+        """
+        Adds one pattern/template pair to the trie.
+        Duplicate patterns keep every template so responses can vary.
+        """
+        node = self.root
+        for word in pattern.replace("\u2019", "'").upper().split():
+            node = node.setdefault(word, {})
+        node.setdefault(None, []).append(template)
+        self.category_count += 1
+
+    def load(self, file_path):
+        """
+        Parses an AIML file and compiles all of its categories into the trie.
+        Returns the number of categories loaded.
+        """
+        loaded = 0
+        for category in ET.parse(file_path).getroot().iter("category"):
+            pattern = category.find("pattern")
+            template = category.find("template")
+            if pattern is None or template is None or not (pattern.text or "").strip():
+                continue
+            self.add_category(pattern.text.strip(), template)
+            loaded += 1
+        return loaded
+
+    def _match(self, node, words, originals, index, stars):
+        """
+        Walks the trie recursively in AIML priority order (`_`, exact word, `*`)
+        and returns (templates, stars) for the first complete match.
+        """
+        if index == len(words):
+            return (node[None], stars) if None in node else None
+
+        for key in (self.WILDCARDS[0], words[index], self.WILDCARDS[1]):
+            child = node.get(key)
+            if child is None:
+                continue
+            if key in self.WILDCARDS:
+                # A wildcard consumes one or more words
+                for end in range(index + 1, len(words) + 1):
+                    captured = " ".join(originals[index:end])
+                    found = self._match(child, words, originals, end, stars + [captured])
+                    if found:
+                        return found
+            else:
+                found = self._match(child, words, originals, index + 1, stars)
+                if found:
+                    return found
+        return None
+
+    @staticmethod
+    def render(template, stars):
+        """
+        Renders a template element, replacing <star/> (and <star index="n"/>)
+        with the captured wildcard text and collapsing whitespace.
+        """
+        parts = [template.text or ""]
+        for child in template:
+            if child.tag == "star":
+                index = int(child.get("index", 1)) - 1
+                parts.append(stars[index] if 0 <= index < len(stars) else "")
+            parts.append(child.tail or "")
+        return " ".join("".join(parts).split())
+
+    def respond(self, user_input):
+        """
+        Returns a response for the user input, or None if no category matches.
+        """
+        words, originals = self.normalize(user_input)
+        found = self._match(self.root, words, originals, 0, []) if words else None
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not found:
+            return None
+        templates, stars = found
+        return self.render(random.choice(templates), stars)
+
+    def stats(self):
+        """
+        Reports how many inputs were answered locally versus sent upstream.
+        """
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "categories": self.category_count,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+# Load the AIML knowledge base
+def load_aiml_engine(file_path=AIML_FILE):
+    graphmaster = AIMLGraphmaster()
     try:
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            return response.json().get('message')
-        else:
-            return f"Error: Unable to communicate with Bot Libre (Status Code: {response.status_code})"
-    except requests.exceptions.RequestException as e:
-        return f"Error: {str(e)}"
+        graphmaster.load(file_path)
+    except (IOError, ET.ParseError) as e:
+        print(f"Error loading AIML file: {e}")
+    return graphmaster
+
+# Shared AIML engine, compiled when the first input is matched
+aiml_engine = LazyResource("aiml", load_aiml_engine)
+
+# Report which lazily created subsystems exist and what they cost
+def startup_stats():
+    return {
+        resource_name: {"initialized": resource.initialized, "init_seconds": resource.init_seconds}
+        for resource_name, resource in (("recognizer", recognizer), ("tts_engine", engine), ("aiml", aiml_engine),
+                                         ("asr_backend", asr_backend))
+    }
 
 def is_quit_command(user_input):
     """
@@ -71,23 +418,386 @@ def is_quit_command(user_input):
     quit_commands = ["quit", "exit", "goodbye", "bye"]
     return user_input.strip().lower() in quit_commands
 
+# Response cache settings
+RESPONSE_CACHE_SIZE = 1024  # Maximum number of cached responses
+RESPONSE_CACHE_TTL = 3600  # Seconds before a cached response expires
+
+# Bounded LRU + TTL cache for upstream responses
+class ResponseCache:
+    """
+    Caches refined responses keyed on normalized user input, so repeated
+    greetings and stock phrases skip the Bot Libre and OpenAI round-trips.
+    Least recently used entries are evicted once the cache is full and
+    every entry expires after its time-to-live.
+    """
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def normalize(user_input):
+        """
+        Builds the cache key: lowercase, punctuation stripped, whitespace collapsed.
+        """
+        text = user_input.replace("\u2019", "'").lower()
+        return " ".join(re.findall(r"[\w']+", text))
+
+    def get(self, user_input):
+        """
+        Returns the cached response for the input, or None on a miss.
+        """
+        key = self.normalize(user_input)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, user_input, value, ttl=None):
+        """
+        Stores a response, evicting the least recently used entries if needed.
+        """
+        key = self.normalize(user_input)
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drops every cached response.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Reports cache size and hit/miss/eviction counters.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+# Shared response cache used by generate_response and the /chat API
+response_cache = ResponseCache()
+
+# Context window settings for OpenAI refinement
+COMPLETION_MODEL = "text-davinci-003"
+CONTEXT_TOKEN_BUDGET = 1200  # Prompt tokens available for history, summary and the current turn
+SUMMARY_TOKEN_BUDGET = 200  # Maximum size of the rolling summary of older turns
+CONTEXT_HEADER = "You are Amie, a kind and empathetic Social Emotional Learning companion."
+
+# Token counting for prompt budgeting
+_token_encoding = None
+
+def count_tokens(text):
+    """
+    Counts prompt tokens with tiktoken when it is installed, otherwise
+    estimates roughly four characters per token.
+    """
+    global _token_encoding
+    if tiktoken is not None:
+        if _token_encoding is None:
+            _token_encoding = tiktoken.encoding_for_model(COMPLETION_MODEL)
+        return len(_token_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+# Fold older turns into the running summary
+def summarize_turns(previous_summary, entries, max_tokens=SUMMARY_TOKEN_BUDGET):
+    """
+    Merges the previous summary with turns that no longer fit the context
+    window. Falls back to keeping the most recent text if OpenAI is unavailable.
+    """
+    transcript = "\n".join(f"{entry['role']}: {entry['content']}" for entry in entries)
+    try:
+        require_openai_key()
+        summary_response = openai.Completion.create(
+            model=COMPLETION_MODEL,
+            prompt=(
+                "Update the summary of this conversation between a user and Amie. "
+                "Keep names, feelings, goals and anything Amie promised to follow up on.\n\n"
+                f"Summary so far: {previous_summary or 'none'}\n\n"
+                f"New turns:\n{transcript}\n\nUpdated summary:"
+            ),
+            max_tokens=max_tokens,
+            temperature=0.3
+        )
+        return summary_response.choices[0].text.strip()
+    except Exception as e:
+        print(f"Error summarizing conversation: {e}")
+        combined = f"{previous_summary} {transcript}".strip()
+        return combined[-max_tokens * 4:]
+
+# Token usage reporting for the context builder
+class ContextMetrics:
+    """
+    Tracks how many prompt tokens each OpenAI call sent and how often
+    older turns were folded into the summary.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.total_tokens = 0
+        self.last_tokens = 0
+        self.max_tokens = 0
+        self.summaries = 0
+
+    def record(self, tokens, summarized):
+        with self.lock:
+            self.calls += 1
+            self.total_tokens += tokens
+            self.last_tokens = tokens
+            self.max_tokens = max(self.max_tokens, tokens)
+            self.summaries += 1 if summarized else 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "avg_tokens": self.total_tokens / self.calls if self.calls else 0.0,
+                "last_tokens": self.last_tokens,
+                "max_tokens": self.max_tokens,
+                "summaries": self.summaries,
+            }
+
+context_metrics = ContextMetrics()
+
+# Token-budgeted prompt builder with rolling summarization
+class ContextBuilder:
+    """
+    Packs as many recent turns as fit into a fixed token budget. Turns that
+    fall out of the window are folded into the session's incrementally
+    maintained summary, so prompt size stays flat however long the session runs.
+    """
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, summary_budget=SUMMARY_TOKEN_BUDGET,
+                 summarize=summarize_turns):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.summarize = summarize
+
+    @staticmethod
+    def format_turn(entry):
+        speaker = "Amie" if entry["role"] == "assistant" else "User"
+        return f"{speaker}: {entry['content']}"
+
+    def build(self, session, user_input, botlibre_response):
+        """
+        Returns (prompt, token_count) for refining Bot Libre's reply in the
+        context of the session. Each session's token counts are cached per turn.
+        """
+        current = f"User: {user_input}\nSuggested reply: {botlibre_response}\nAmie:"
+        # Reserve room for the summary so folding never pushes the prompt over budget
+        available = self.budget - count_tokens(CONTEXT_HEADER) - self.summary_budget - count_tokens(current)
+
+        dialogue = session.dialogue
+        turn_tokens = session.dialogue_tokens
+        first_kept = len(dialogue)
+        used = 0
+        while first_kept > session.summarized_upto and used + turn_tokens[first_kept - 1] <= available:
+            first_kept -= 1
+            used += turn_tokens[first_kept]
+
+        summarized = False
+        if first_kept > session.summarized_upto:
+            # Fold until only half the window is used, so the next fold is several turns away
+            while first_kept < len(dialogue) and used > available // 2:
+                used -= turn_tokens[first_kept]
+                first_kept += 1
+            session.summary = self.summarize(session.summary, dialogue[session.summarized_upto:first_kept],
+                                             self.summary_budget)
+            session.summarized_upto = first_kept
+            summarized = True
+
+        lines = [CONTEXT_HEADER]
+        if session.summary:
+            lines.append(f"Summary of the earlier conversation: {session.summary}")
+        lines.extend(self.format_turn(entry) for entry in dialogue[first_kept:])
+        lines.append(current)
+        prompt = "\n".join(lines)
+        tokens = count_tokens(prompt)
+        context_metrics.record(tokens, summarized)
+        return prompt, tokens
+
+# Shared context builder for history-aware responses
+context_builder = ContextBuilder()
+
+# Build the OpenAI prompt for refining a Bot Libre reply
+def build_refinement_prompt(user_input, botlibre_response, conversation_log=None):
+    """
+    Without a conversation the Bot Libre reply is refined on its own, as before.
+    With one, the prompt carries a token-budgeted window of the session.
+    """
+    if conversation_log is None:
+        return botlibre_response
+    if not isinstance(conversation_log, Session):
+        conversation_log = Session(conversation_log)
+    prompt, _ = context_builder.build(conversation_log, user_input, botlibre_response)
+    return prompt
+
 # Function to generate responses by combining Bot Libre and OpenAI
-def generate_response(user_input):
+def generate_response(user_input, conversation_log=None, cacheable=True):
     """
-    Generate a response using Bot Libre and optionally refine it with OpenAI.
+    Generate a response using the local AIML knowledge base when it has a match.
+    Otherwise fall back to Bot Libre and refine its answer with OpenAI,
+    using the conversation so far as context when one is given.
+    Refined responses are cached unless the turn is session-specific (cacheable=False).
     """
+    # Answer locally if the AIML knowledge base covers this input
+    aiml_response = aiml_engine.respond(user_input)
+    if aiml_response:
+        return aiml_response
+
+    # Answers that depend on earlier turns are session-specific
+    if conversation_log:
+        cacheable = False
+
+    # Reuse a recent answer to the same input
+    if cacheable:
+        cached_response = response_cache.get(user_input)
+        if cached_response is not None:
+            return cached_response
+
     # Get response from Bot Libre
     botlibre_response = send_message_to_botlibre(user_input)
     
     # Use OpenAI to refine the Bot Libre response
+    require_openai_key()
     openai_response = openai.Completion.create(
-        model="text-davinci-003",
-        prompt=botlibre_response,
+        model=COMPLETION_MODEL,
+        prompt=build_refinement_prompt(user_input, botlibre_response, conversation_log),
         max_tokens=150,
         temperature=0.7
     )
+    refined_response = openai_response.choices[0].text.strip()
+
+    # Don't cache answers built from a failed Bot Libre call
+    if cacheable and refined_response and not botlibre_response.startswith("Error:"):
+        response_cache.put(user_input, refined_response)
+
     # Return OpenAI-refined response
-    return openai_response.choices[0].text.strip()
+    return refined_response
+
+# Latency accounting for streamed responses
+class StreamMetrics:
+    """
+    Tracks time-to-first-token separately from total generation time
+    for streamed responses.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = 0
+        self.total_ttft = 0.0
+        self.total_time = 0.0
+        self.last_ttft = 0.0
+        self.last_time = 0.0
+
+    def record(self, ttft, total):
+        """
+        Adds the timings of one completed stream.
+        """
+        with self.lock:
+            self.streams += 1
+            self.total_ttft += ttft
+            self.total_time += total
+            self.last_ttft = ttft
+            self.last_time = total
+
+    def stats(self):
+        """
+        Reports average and last time-to-first-token and total time.
+        """
+        with self.lock:
+            return {
+                "streams": self.streams,
+                "avg_ttft_ms": 1000 * self.total_ttft / self.streams if self.streams else 0.0,
+                "avg_total_ms": 1000 * self.total_time / self.streams if self.streams else 0.0,
+                "last_ttft_ms": 1000 * self.last_ttft,
+                "last_total_ms": 1000 * self.last_time,
+            }
+
+stream_metrics = StreamMetrics()
+
+# Streaming variant of generate_response
+def generate_response_stream(user_input, conversation_log=None, cacheable=True, timings=None):
+    """
+    Yields the response in pieces as OpenAI produces them instead of waiting
+    for the whole completion. AIML and cached answers are yielded in one piece.
+    If a timings dict is passed it receives ttft_ms and total_ms once the stream ends.
+    """
+    if conversation_log:
+        cacheable = False
+    start = time.perf_counter()
+    first_token_at = None
+    pieces = []
+
+    def finish():
+        end = time.perf_counter()
+        ttft = (first_token_at or end) - start
+        stream_metrics.record(ttft, end - start)
+        if timings is not None:
+            timings["ttft_ms"] = 1000 * ttft
+            timings["total_ms"] = 1000 * (end - start)
+
+    local_response = aiml_engine.respond(user_input)
+    if not local_response and cacheable:
+        local_response = response_cache.get(user_input)
+    if local_response:
+        first_token_at = time.perf_counter()
+        yield local_response
+        finish()
+        return
+
+    botlibre_response = send_message_to_botlibre(user_input)
+    require_openai_key()
+    completion = openai.Completion.create(
+        model=COMPLETION_MODEL,
+        prompt=build_refinement_prompt(user_input, botlibre_response, conversation_log),
+        max_tokens=150,
+        temperature=0.7,
+        stream=True
+    )
+    for chunk in completion:
+        token = chunk.choices[0].text
+        # Completions usually open with blank lines; skip them like strip() does
+        if not pieces:
+            token = token.lstrip()
+        if not token:
+            continue
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        pieces.append(token)
+        yield token
+
+    refined_response = "".join(pieces).strip()
+    if cacheable and refined_response and not botlibre_response.startswith("Error:"):
+        response_cache.put(user_input, refined_response)
+    finish()
 
 # Predefined keywords and phrases
 FORBIDDEN_TOPICS = ["violence", "hate", "insult", "offensive", "foul language"]
@@ -95,6 +805,842 @@ NEGATIVE_KEYWORDS = ["sad", "upset", "depressed", "worthless", "angry", "mad", "
 POSITIVE_KEYWORDS = ["happy", "excited", "joyful", "proud", "calm"]
 QUIT_KEYWORDS = ["i am done", "goodbye", "leave", "exit", "quit", "bye"]
 
+# Suffixes an emotion keyword may carry ("hate" -> "hates", "sad" -> "sadness")
+KEYWORD_SUFFIXES = ("s", "es", "ed", "ing", "ness", "ly", "er", "en")
+KEYWORD_VOWEL_SUFFIXES = ("ed", "ing", "er", "en")  # Suffixes that drop a final e or double a consonant
+
+# Inflected forms of a keyword
+def keyword_inflections(phrase):
+    """
+    Returns the phrase plus common inflections of its last word, e.g.
+    hate -> hates, hated, hating; upset -> upsetting; angry -> angrier.
+    Generated forms that are not words are harmless: they never match.
+    """
+    head, _, word = phrase.rpartition(" ")
+    forms = {word} | {word + suffix for suffix in KEYWORD_SUFFIXES}
+    vowels = "aeiou"
+    if word.endswith("e"):
+        forms |= {word[:-1] + suffix for suffix in KEYWORD_VOWEL_SUFFIXES}
+    elif word.endswith("y"):
+        forms |= {word[:-1] + "i" + suffix for suffix in ("es", "ed", "er", "ness", "ly")}
+    elif (len(word) >= 3 and word[-1] not in vowels + "wxy" and word[-2] in vowels
+          and word[-3] not in vowels):
+        forms |= {word + word[-1] + suffix for suffix in KEYWORD_VOWEL_SUFFIXES}
+    return sorted((head + " " + form) if head else form for form in forms)
+
+# Precompiled multi-pattern keyword matcher
+class KeywordMatcher:
+    """
+    Matches several keyword sets with one precompiled regex alternation.
+    Keywords only match as whole words ("mad" no longer fires inside "made"),
+    and one linear pass over the input reports the hits for every set.
+    Keywords in the inflected sets also match their inflections ("hated",
+    "sadness"), reported as the base keyword.
+    The alternation is built as a character trie so shared prefixes are only tested once.
+    """
+    def __init__(self, keyword_sets, inflected=()):
+        self.names = list(keyword_sets)
+        self.keywords_by_form = {}  # Matched text -> [(set name, keyword)]
+        for name, phrases in keyword_sets.items():
+            for phrase in phrases:
+                phrase = " ".join(phrase.lower().split())
+                for form in keyword_inflections(phrase) if name in inflected else [phrase]:
+                    keywords = self.keywords_by_form.setdefault(form, [])
+                    if (name, phrase) not in keywords:
+                        keywords.append((name, phrase))
+        self.pattern = re.compile(r"\b" + self._trie_pattern(self.keywords_by_form) + r"\b")
+
+    @classmethod
+    def _trie_pattern(cls, phrases):
+        """
+        Compiles phrases into a prefix-factored alternation, e.g. ex(?:cited|it).
+        Spaces inside phrases match any run of whitespace.
+        """
+        trie = {}
+        for phrase in phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        return cls._trie_node_pattern(trie)
+
+    @classmethod
+    def _trie_node_pattern(cls, node):
+        branches = [
+            (r"\s+" if char == " " else re.escape(char)) + cls._trie_node_pattern(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A complete phrase ends here, so the longer continuations are optional
+            body = "(?:" + body + ")?"
+        return body
+
+    def classify(self, text):
+        """
+        Returns a dict mapping each keyword set name to the keywords found in the text.
+        """
+        hits = {name: [] for name in self.names}
+        for found in self.pattern.findall(text.lower()):
+            for name, phrase in self.keywords_by_form[" ".join(found.split())]:
+                hits[name].append(phrase)
+        return hits
+
+keyword_matcher = KeywordMatcher({
+    "negative": NEGATIVE_KEYWORDS,
+    "positive": POSITIVE_KEYWORDS,
+    "quit": QUIT_KEYWORDS,
+    "forbidden": FORBIDDEN_TOPICS,
+}, inflected=("negative", "positive", "forbidden"))
+
+# Micro-benchmark: compiled matcher versus the original substring scans
+def benchmark_keyword_matching(iterations=20000):
+    """
+    Times classifying sample utterances against all keyword sets using the
+    original any(word in text ...) scans and the compiled matcher.
+    """
+    samples = [
+        "i made a new friend today and i am so happy",
+        "whatever, i feel sad and a little angry",
+        "can you help me with my homework",
+        "i am done for today, goodbye",
+        "my brother was being mean and i hate it",
+    ]
+    keyword_sets = (NEGATIVE_KEYWORDS, POSITIVE_KEYWORDS, QUIT_KEYWORDS, FORBIDDEN_TOPICS)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in samples:
+            [[word for word in keywords if word in text] for keywords in keyword_sets]
+    substring_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in samples:
+            keyword_matcher.classify(text)
+    compiled_time = time.perf_counter() - start
+
+    # Substring scans also report spurious hits such as "mad" in "made" and "hate" in "whatever"
+    substring_hits = sum(len([w for w in keywords if w in text]) for text in samples for keywords in keyword_sets)
+    matcher_hits = sum(len(found) for text in samples for found in keyword_matcher.classify(text).values())
+
+    calls = iterations * len(samples)
+    results = {
+        "substring_scan_hits": substring_hits,
+        "compiled_matcher_hits": matcher_hits,
+        "substring_scan_us": 1e6 * substring_time / calls,
+        "compiled_matcher_us": 1e6 * compiled_time / calls,
+        "speedup": substring_time / compiled_time if compiled_time else 0.0,
+    }
+    print(f"Keyword matching benchmark: {results}")
+    return results
+
+# Indexed conversation log for a single session
+class Session(list):
+    """
+    Conversation log that keeps its own indexes up to date on append:
+    entries per role, the user/assistant dialogue, every prompt already
+    asked, and running feedback totals. Queries that used to rescan the
+    whole log are O(1) per turn. Behaves like the plain list it replaces.
+    Also holds the rolling summary of turns that left the context window,
+    the user's profile (name, age) and an estimate of its memory footprint.
+    """
+    DIALOGUE_ROLES = ("user", "assistant")
+    ENTRY_OVERHEAD = 200  # Approximate bytes per entry beyond its JSON encoding
+
+    def __init__(self, entries=(), session_id=None):
+        super().__init__()
+        self.session_id = session_id or uuid.uuid4().hex
+        self.profile = {}
+        self.pending_goals = []  # Goals set over the API before the user's name was known
+        self.lock = threading.Lock()  # Serializes API turns on this session
+        self.async_lock = None  # Same, for the asyncio server; created on its event loop
+        self.prompt_sampler = None
+        self.asked_prompts = set()
+        self.revision = 0  # Bumped by any mutation other than append
+        self.debug_seq = 0  # Last debug log record written for this session
+        self.debug_cursor = 0  # Entries already covered by the debug log
+        self.debug_revision = None  # Revision the debug log last saw
+        self._reset_indexes()
+        self.extend(entries)
+
+    def _reset_indexes(self):
+        self.by_role = {}
+        self.dialogue = []
+        self.dialogue_tokens = []
+        self.summary = ""
+        self.summarized_upto = 0
+        self.used_prompts = set(self.asked_prompts)
+        self.feedback_count = 0
+        self.feedback_total = 0
+        self.feedback_comments = []
+        self.approx_bytes = 0
+
+    def _index(self, entry):
+        self.approx_bytes += len(json.dumps(entry, default=str)) + self.ENTRY_OVERHEAD
+        role = entry.get("role")
+        self.by_role.setdefault(role, []).append(entry)
+        if role in self.DIALOGUE_ROLES:
+            self.dialogue.append(entry)
+            self.dialogue_tokens.append(count_tokens(ContextBuilder.format_turn(entry)) + 1)
+        if role == "assistant":
+            self.used_prompts.add(entry["content"])
+        elif role == "feedback":
+            feedback = entry["content"]
+            self.feedback_count += 1
+            self.feedback_total += feedback["rating"]
+            if feedback.get("comment"):
+                self.feedback_comments.append(feedback["comment"])
+
+    def _reindex(self):
+        self.revision += 1
+        self._reset_indexes()
+        for entry in self:
+            self._index(entry)
+
+    def append(self, entry):
+        super().append(entry)
+        self._index(entry)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def __iadd__(self, entries):
+        self.extend(entries)
+        return self
+
+    def clear(self):
+        super().clear()
+        self.prompt_sampler = None
+        self.asked_prompts.clear()
+        self.revision += 1
+        self._reset_indexes()
+
+    # Less common mutations rebuild the indexes from scratch
+    def insert(self, index, entry):
+        super().insert(index, entry)
+        self._reindex()
+
+    def pop(self, index=-1):
+        entry = super().pop(index)
+        self._reindex()
+        return entry
+
+    def remove(self, entry):
+        super().remove(entry)
+        self._reindex()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._reindex()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._reindex()
+
+    def entries(self, role):
+        """
+        Returns every entry with the given role, in order.
+        """
+        return self.by_role.get(role, [])
+
+    def sampler(self):
+        """
+        Returns this session's SEL prompt sampler, so prompts don't repeat within the session.
+        """
+        if self.prompt_sampler is None:
+            self.prompt_sampler = PromptSampler(sel_catalog)
+        return self.prompt_sampler
+
+    def mark_prompt_used(self, prompt):
+        """
+        Records a prompt that was asked without being logged as an assistant turn.
+        """
+        self.asked_prompts.add(prompt)
+        self.used_prompts.add(prompt)
+
+    def feedback_summary(self):
+        """
+        Returns the running feedback aggregates, or None if no feedback was given.
+        """
+        if not self.feedback_count:
+            return None
+        return {
+            "average_rating": self.feedback_total / self.feedback_count,
+            "comments": list(self.feedback_comments),
+            "total_feedback": self.feedback_count,
+        }
+
+# Structured conversation log settings
+CONVERSATION_LOG_FILE = "conversation_log.jsonl"
+LOG_BATCH_SIZE = 100  # Records written per batch
+LOG_FLUSH_INTERVAL = 1.0  # Seconds before a partial batch is written
+LOG_FSYNC_POLICY = os.getenv("AMIE_LOG_FSYNC", "interval")  # "always", "interval" or "never"
+LOG_FSYNC_INTERVAL = 5.0  # Seconds between fsyncs under the "interval" policy
+LOG_ROTATE_BYTES = 10 * 1024 * 1024  # Rotate the active file once it reaches this size
+LOG_BACKUP_COUNT = 5  # Compressed rotated files to keep
+LOG_QUEUE_SIZE = 10000  # Records buffered before new ones are dropped
+
+# Background JSONL log writer
+class JSONLLogSink:
+    """
+    Writes structured log records as JSON lines from a background thread.
+    Records are batched and written when the batch fills or the flush
+    interval passes, fsynced according to the policy, and the file is rotated
+    and gzip-compressed once it grows past the size limit. emit() never
+    blocks: when the queue is full the record is dropped and counted.
+    """
+    def __init__(self, path, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL,
+                 fsync_policy=LOG_FSYNC_POLICY, fsync_interval=LOG_FSYNC_INTERVAL,
+                 rotate_bytes=LOG_ROTATE_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 queue_size=LOG_QUEUE_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.rotate_bytes = rotate_bytes
+        self.backup_count = backup_count
+        self.records = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.file = None
+        self.last_fsync = time.monotonic()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+
+    def start(self):
+        """
+        Starts the writer thread if it is not already running.
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="amie-log-sink", daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+
+    def emit(self, record):
+        """
+        Queues one record (a JSON-serializable dict) without blocking.
+        Returns False if the record had to be dropped.
+        """
+        self.start()
+        try:
+            self.records.put_nowait(record)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def flush(self, timeout=5):
+        """
+        Blocks until every record queued so far has been written.
+        """
+        if self.thread is None:
+            return True
+        done = threading.Event()
+        try:
+            self.records.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self):
+        """
+        Writes everything still queued and closes the file.
+        """
+        if self.thread is not None and self.flush():
+            self.records.put(None)
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            batch = []
+            markers = []
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.records.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                if isinstance(record, threading.Event):
+                    markers.append(record)
+                    break
+                batch.append(record)
+            if batch:
+                try:
+                    self._write(batch)
+                except (IOError, OSError, TypeError, ValueError) as e:
+                    print(f"Error writing log batch to {self.path}: {e}")
+            for marker in markers:
+                marker.set()
+            if stopping:
+                if self.file:
+                    self._sync()
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _write(self, batch):
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.write("".join(json.dumps(record, default=str) + "\n" for record in batch))
+        self.file.flush()
+        self.written += len(batch)
+        self.batches += 1
+        now = time.monotonic()
+        if self.fsync_policy == "always" or (
+                self.fsync_policy == "interval" and now - self.last_fsync >= self.fsync_interval):
+            self._sync()
+        if self.rotate_bytes and self.file.tell() >= self.rotate_bytes:
+            self._rotate()
+
+    def _sync(self):
+        if self.fsync_policy != "never":
+            os.fsync(self.file.fileno())
+        self.last_fsync = time.monotonic()
+
+    def _rotate(self):
+        """
+        Compresses the active file to <path>.1.gz, shifting older backups up.
+        """
+        self._sync()
+        self.file.close()
+        self.file = None
+        for index in range(self.backup_count - 1, 0, -1):
+            older = f"{self.path}.{index}.gz"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}.gz")
+        with open(self.path, "rb") as source, gzip.open(f"{self.path}.1.gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(self.path)
+        self.rotations += 1
+
+    def stats(self):
+        return {
+            "queued": self.records.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "rotations": self.rotations,
+        }
+
+# Shared sink for conversation records
+conversation_sink = JSONLLogSink(CONVERSATION_LOG_FILE)
+
+# Incremental debug log
+DEBUG_LOG_FILE = "debug_log.jsonl"
+DEBUG_LOG_ENABLED = os.getenv("AMIE_DEBUG_LOG", "0") == "1"  # Log each voice turn and session end
+debug_sink = JSONLLogSink(DEBUG_LOG_FILE)
+
+# Read a JSONL log together with its rotated backups, oldest first
+def read_jsonl_log(path):
+    """
+    Yields the records of a JSONLLogSink file, including compressed backups.
+    """
+    backups = []
+    index = 1
+    while os.path.exists(f"{path}.{index}.gz"):
+        backups.append(f"{path}.{index}.gz")
+        index += 1
+    for backup in reversed(backups):
+        with gzip.open(backup, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+# Rebuild a session's conversation state from the delta debug log
+def reconstruct_debug_state(session_id, seq=None, path=DEBUG_LOG_FILE):
+    """
+    Replays the debug records of one session up to (and including) event
+    number seq, or to the latest event if seq is None.
+    Returns (event_type, entries), or (None, []) if nothing was logged.
+    """
+    entries = []
+    event_type = None
+    for record in read_jsonl_log(path):
+        if record.get("session_id") != session_id:
+            continue
+        if seq is not None and record["seq"] > seq:
+            break
+        if record["type"] == "snapshot":
+            entries = []
+        entries.extend({"role": entry["role"], "content": entry["content"]} for entry in record["entries"])
+        event_type = record["event"]
+    return event_type, entries
+
+# Multi-user profile store settings
+USER_STORE_FILE = "amie_users.db"
+LEGACY_PREFERENCES_FILE = "user_preferences.json"
+USER_STORE_CACHE_SIZE = 10000  # Profiles kept in the in-memory read-through cache
+USER_STORE_FLUSH_INTERVAL = 0.5  # Seconds that updates are coalesced before being written
+DEFAULT_USER_ID = "default"
+
+# Map a user's name to their profile key
+def user_id_for(name):
+    """
+    Returns the store key for a user, falling back to the shared default profile.
+    """
+    return " ".join(name.lower().split()) if name else DEFAULT_USER_ID
+
+# Keyed per-user store for profiles, preferences and goals
+class UserStore:
+    """
+    Stores one JSON document per user ({"profile", "preferences", "goals"})
+    in SQLite using WAL mode. Reads go through an LRU cache, updates are
+    applied atomically in memory and written in coalesced batches by a
+    background thread, so repeated updates to a profile cost one row write.
+    """
+    def __init__(self, path=USER_STORE_FILE, cache_size=USER_STORE_CACHE_SIZE,
+                 flush_interval=USER_STORE_FLUSH_INTERVAL, legacy_file=LEGACY_PREFERENCES_FILE):
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.legacy_file = legacy_file
+        self.lock = threading.RLock()
+        self.cache = OrderedDict()
+        self.dirty = {}
+        self.dirty_meta = {}
+        self.wakeup = threading.Event()
+        self.connection = None
+        self.thread = None
+        self.writes = 0
+        self.flushes = 0
+
+    @staticmethod
+    def empty_record():
+        return {"profile": {}, "preferences": {}, "goals": []}
+
+    def _connect(self):
+        """
+        Opens the database on first use, creating the schema and importing
+        the legacy single-user preferences file if the store is new.
+        """
+        if self.connection is not None:
+            return self.connection
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.thread = threading.Thread(target=self._run, name="amie-user-store", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+        self.import_legacy_file(self.legacy_file)
+        return self.connection
+
+    def import_legacy_file(self, path):
+        """
+        Imports a single-user preferences file, but only into an empty store.
+        """
+        if not path or not os.path.exists(path):
+            return
+        if self._connect().execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return
+        try:
+            with open(path, "r") as f:
+                legacy = json.load(f)
+        except (IOError, json.JSONDecodeError) as e:
+            print(f"Error importing {path}: {e}")
+            return
+        user_id = user_id_for(legacy.get("name"))
+        self.update(user_id, lambda record: record.update(
+            profile={"name": legacy.get("name"), "age": legacy.get("age")},
+            preferences=legacy.get("preferences") or {},
+        ))
+        self.set_meta("last_user", user_id)
+        self.flush()
+
+    def _cache_put(self, user_id, record):
+        self.cache[user_id] = record
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.cache_size:
+            oldest = next(iter(self.cache))
+            if oldest in self.dirty:
+                # Unwritten records stay cached until the next flush
+                break
+            del self.cache[oldest]
+
+    def _load(self, user_id):
+        record = self.cache.get(user_id)
+        if record is not None:
+            self.cache.move_to_end(user_id)
+            return record
+        row = self._connect().execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        record = json.loads(row[0]) if row else None
+        if record is not None:
+            self._cache_put(user_id, record)
+        return record
+
+    def get(self, user_id):
+        """
+        Returns a copy of the user's record, or None if the user is unknown.
+        """
+        with self.lock:
+            record = self._load(user_id)
+            return copy.deepcopy(record) if record is not None else None
+
+    def update(self, user_id, change):
+        """
+        Atomically applies change(record) to the user's record (created if
+        missing) and queues it to be written. Returns a copy of the new record.
+        """
+        with self.lock:
+            record = copy.deepcopy(self._load(user_id)) or self.empty_record()
+            change(record)
+            self._cache_put(user_id, record)
+            self.dirty[user_id] = record
+        self.wakeup.set()
+        return copy.deepcopy(record)
+
+    def get_meta(self, key):
+        with self.lock:
+            if key in self.dirty_meta:
+                return self.dirty_meta[key]
+            row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self._connect()
+            self.dirty_meta[key] = value
+        self.wakeup.set()
+
+    def flush(self):
+        """
+        Writes all pending updates in a single transaction.
+        """
+        with self.lock:
+            if not self.dirty and not self.dirty_meta:
+                return 0
+            connection = self._connect()
+            rows = [(user_id, json.dumps(record), time.time()) for user_id, record in self.dirty.items()]
+            meta_rows = list(self.dirty_meta.items())
+            try:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    "INSERT INTO users (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    rows,
+                )
+                connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta_rows)
+                connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                connection.execute("ROLLBACK")
+                print(f"Error saving user profiles: {e}")
+                return 0
+            self.dirty.clear()
+            self.dirty_meta.clear()
+            self.writes += len(rows)
+            self.flushes += 1
+            return len(rows)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            # Let further updates accumulate so they are written together
+            time.sleep(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "cached": len(self.cache),
+                "pending": len(self.dirty),
+                "rows_written": self.writes,
+                "flushes": self.flushes,
+            }
+
+# Shared user store
+user_store = UserStore()
+
+# Persist a user's profile and mark them as the most recent user
+def remember_user(name, age, preferences=None):
+    """
+    Saves name and age (and optionally merges preferences) into the user store.
+    """
+    user_id = user_id_for(name)
+
+    def change(record):
+        record["profile"].update(name=name, age=age)
+        if preferences:
+            record["preferences"].update(preferences)
+
+    record = user_store.update(user_id, change)
+    user_store.set_meta("last_user", user_id)
+    return record
+
+# Load the profile of the most recent user
+def load_last_user():
+    """
+    Returns the record of the user who was most recently saved, or None.
+    """
+    user_id = user_store.get_meta("last_user")
+    return user_store.get(user_id) if user_id else None
+
+# API session registry settings
+SESSION_MAX_COUNT = 10000  # Live /chat sessions kept in memory
+SESSION_IDLE_TTL = 30 * 60  # Seconds of inactivity before a session is dropped
+SESSION_MEMORY_LIMIT = 256 * 1024 * 1024  # Approximate bytes of conversation state kept in memory
+
+# In-memory registry of /chat sessions
+class SessionRegistry:
+    """
+    Maps session ids to Session objects for the HTTP API. Sessions are kept in
+    least-recently-used order, so lookups are O(1) and idle or excess sessions
+    are always evicted from the front. Limits apply to the number of sessions,
+    their idle time and their estimated total size.
+    """
+    def __init__(self, max_sessions=SESSION_MAX_COUNT, idle_ttl=SESSION_IDLE_TTL,
+                 memory_limit=SESSION_MEMORY_LIMIT):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.memory_limit = memory_limit
+        self.sessions = OrderedDict()  # session_id -> (session, last_used, bytes counted)
+        self.lock = threading.Lock()
+        self.bytes_used = 0
+        self.created = 0
+        self.evictions = {"idle": 0, "capacity": 0, "memory": 0}
+
+    def _drop(self, session_id, reason):
+        session, _, size = self.sessions.pop(session_id)
+        self.bytes_used -= size
+        if reason in self.evictions:
+            self.evictions[reason] += 1
+        conversation_sink.emit({"ts": time.time(), "type": "end", "session_id": session_id, "reason": reason})
+        return session
+
+    def _evict(self, now):
+        while self.sessions:
+            oldest_id, (_, last_used, _) = next(iter(self.sessions.items()))
+            if now - last_used > self.idle_ttl:
+                self._drop(oldest_id, "idle")
+            elif len(self.sessions) > self.max_sessions:
+                self._drop(oldest_id, "capacity")
+            elif self.bytes_used > self.memory_limit and len(self.sessions) > 1:
+                self._drop(oldest_id, "memory")
+            else:
+                break
+
+    def get(self, session_id=None):
+        """
+        Returns the live session with this id, creating it (with a new id if
+        none was given) when it does not exist or has expired.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._evict(now)
+            if session_id in self.sessions:
+                session, _, size = self.sessions[session_id]
+                self.sessions[session_id] = (session, now, size)
+                self.sessions.move_to_end(session_id)
+                return session
+            session = Session(session_id=session_id)
+            self.sessions[session.session_id] = (session, now, session.approx_bytes)
+            self.bytes_used += session.approx_bytes
+            self.created += 1
+            return session
+
+    def touch(self, session):
+        """
+        Refreshes a session's size after a turn and applies the memory limit.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if session.session_id not in self.sessions:
+                return
+            _, _, size = self.sessions[session.session_id]
+            self.bytes_used += session.approx_bytes - size
+            self.sessions[session.session_id] = (session, now, session.approx_bytes)
+            self.sessions.move_to_end(session.session_id)
+            self._evict(now)
+
+    def end(self, session_id):
+        """
+        Removes a session, returning it or None if it was not live.
+        """
+        with self.lock:
+            if session_id not in self.sessions:
+                return None
+            return self._drop(session_id, "ended")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "live": len(self.sessions),
+                "created": self.created,
+                "evictions": dict(self.evictions),
+                "bytes_used": self.bytes_used,
+            }
+
+# Shared registry used by the HTTP API
+session_registry = SessionRegistry()
+
+# Check and normalize the SEL fields of an API request
+def parse_session_fields(body):
+    """
+    Returns the request's name, age and feedback, with age and rating as
+    integers (query-string values arrive as text). Raises ValueError naming
+    the first invalid field, before anything is stored.
+    """
+    fields = {"name": body.get('name') or None, "age": None, "feedback": None}
+    if fields["name"] is not None and not isinstance(fields["name"], str):
+        raise ValueError("name must be a string")
+    if body.get('age') is not None:
+        try:
+            fields["age"] = int(body['age'])
+        except (TypeError, ValueError):
+            raise ValueError("age must be an integer")
+        if not 5 <= fields["age"] <= 50:
+            raise ValueError("age must be between 5 and 50")
+    feedback = body.get('feedback')
+    if isinstance(feedback, dict) and feedback.get('rating') is not None:
+        try:
+            rating = int(feedback['rating'])
+        except (TypeError, ValueError):
+            raise ValueError("feedback rating must be an integer")
+        if not 1 <= rating <= 5:
+            raise ValueError("feedback rating must be between 1 and 5")
+        fields["feedback"] = {"rating": rating, "comment": feedback.get('comment')}
+    return fields
+
+# Apply the SEL fields of an API request to its session
+def apply_session_fields(session, body):
+    """
+    Updates the session from optional name, age, feedback and goal fields
+    so the profile, feedback and goal features are reachable over HTTP.
+    Profiles and goals are only saved to the user store once the user's name
+    is known; until then goals wait on the session.
+    """
+    fields = parse_session_fields(body)
+    if fields["name"] or fields["age"] is not None:
+        session.profile.update({key: fields[key] for key in ('name', 'age') if fields[key] is not None})
+        if session.profile.get('name'):
+            remember_user(session.profile['name'], session.profile.get('age'))
+    if fields["feedback"]:
+        session.append({"role": "feedback", "content": fields["feedback"]})
+    if body.get('goal'):
+        session.pending_goals.append({"goal": body['goal'], "status": "set", "created_at": time.time()})
+    if session.pending_goals and session.profile.get('name'):
+        goals, session.pending_goals = session.pending_goals, []
+        user_store.update(user_id_for(session.profile['name']), lambda record: record["goals"].extend(goals))
+
 # SEL prompts and questions categorized by age group
 SEL_PROMPTS = {
     "child": [
@@ -114,19 +1660,1141 @@ SEL_PROMPTS = {
     ]
 }
 
+# Pre-rendered audio cache settings
+AUDIO_CACHE_ENABLED = os.getenv("AMIE_AUDIO_CACHE", "1") == "1"
+AUDIO_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache")
+AUDIO_PLAYBACK_CHUNK = 4096  # Bytes written to the audio device per iteration
+
+# Locate the format and sample data of a RIFF/WAVE buffer
+def parse_wav_layout(buffer):
+    """
+    Returns (channels, sample_rate, sample_width, data_offset, data_size)
+    for a PCM WAV buffer, or None if it is not a WAV file.
+    """
+    if len(buffer) < 12 or buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        return None
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(buffer):
+        chunk_id = buffer[offset:offset + 4]
+        chunk_size = struct.unpack_from("<I", buffer, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            _, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", buffer, body)
+            fmt = (channels, sample_rate, bits // 8)
+        elif chunk_id == b"data" and fmt:
+            # Some writers leave the size unset when streaming; trust the file length instead
+            return fmt + (body, min(chunk_size, len(buffer) - body))
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+# Synthesized-audio cache for static utterances
+class AudioCache:
+    """
+    Stores synthesized speech on disk as WAV files keyed by (text, voice, rate)
+    and plays hits straight from a memory map, so fixed prompts are never
+    re-synthesized. Texts shaped like "Prefix: literal" also hit when both parts are cached.
+    """
+    def __init__(self, directory=AUDIO_CACHE_DIR):
+        self.directory = directory
+        self.index = set()
+        self.lock = threading.Lock()  # Guards the index and counters
+        self.hits = 0
+        self.misses = 0
+        self.pyaudio = None
+        if os.path.isdir(directory):
+            self.index = {name for name in os.listdir(directory) if name.endswith(".wav")}
+
+    @staticmethod
+    def key(text, voice, rate):
+        """
+        Returns the cache file name for an utterance.
+        """
+        digest = hashlib.sha1(f"{voice}\0{rate}\0{text.strip()}".encode("utf-8")).hexdigest()
+        return f"{digest}.wav"
+
+    def path(self, text, voice, rate):
+        return os.path.join(self.directory, self.key(text, voice, rate))
+
+    def contains(self, text, voice, rate):
+        return self.key(text, voice, rate) in self.index
+
+    def add(self, text, voice, rate):
+        """
+        Registers a freshly rendered file, if synthesis produced a playable WAV.
+        """
+        path = self.path(text, voice, rate)
+        try:
+            with open(path, "rb") as f:
+                if parse_wav_layout(f.read(4096)) is None:
+                    raise ValueError("not a PCM WAV file")
+        except (IOError, ValueError, struct.error) as e:
+            print(f"Error caching audio for '{text}': {e}")
+            return False
+        with self.lock:
+            self.index.add(self.key(text, voice, rate))
+        return True
+
+    def discard(self, paths):
+        """
+        Drops entries that failed to play, so later requests synthesize them instead.
+        """
+        with self.lock:
+            for path in paths:
+                self.index.discard(os.path.basename(path))
+
+    def lookup(self, text, voice, rate):
+        """
+        Returns the cached files that together speak the text, or None on a miss.
+        """
+        prefix, separator, rest = text.partition(": ")
+        with self.lock:
+            if self.contains(text, voice, rate):
+                self.hits += 1
+                return [self.path(text, voice, rate)]
+            if separator and self.contains(prefix + ":", voice, rate) and self.contains(rest, voice, rate):
+                self.hits += 1
+                return [self.path(prefix + ":", voice, rate), self.path(rest, voice, rate)]
+            self.misses += 1
+        return None
+
+    def play(self, path, cancel_event):
+        """
+        Plays a cached WAV file from a memory map. Returns False if cancelled.
+        """
+        if self.pyaudio is None:
+            import pyaudio
+            self.pyaudio = pyaudio.PyAudio()
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            layout = parse_wav_layout(mapped)
+            if layout is None:
+                raise ValueError(f"{path} is not a PCM WAV file")
+            channels, sample_rate, sample_width, offset, size = layout
+            stream = self.pyaudio.open(
+                format=self.pyaudio.get_format_from_width(sample_width),
+                channels=channels,
+                rate=sample_rate,
+                output=True,
+            )
+            view = memoryview(mapped)
+            try:
+                for start in range(offset, offset + size, AUDIO_PLAYBACK_CHUNK):
+                    if cancel_event.is_set():
+                        return False
+                    stream.write(bytes(view[start:min(start + AUDIO_PLAYBACK_CHUNK, offset + size)]))
+            finally:
+                view.release()
+                stream.stop_stream()
+                stream.close()
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.index), "hits": self.hits, "misses": self.misses}
+
+# Shared cache of pre-rendered utterances
+audio_cache = AudioCache()
+
+# Barge-in settings
+BARGE_IN_ENABLED = os.getenv("AMIE_BARGE_IN", "0") == "1"  # Let the user interrupt Amie by talking
+BARGE_IN_ENERGY_RATIO = 1.5  # Microphone energy, relative to the threshold, that counts as talking
+BARGE_IN_FRAMES = 3  # Consecutive loud chunks needed before speech is cut off
+TTS_WAIT_TIMEOUT = 30  # Longest wait for queued speech before carrying on without it
+
+# One queued utterance for the TTS worker
+class SpeechItem:
+    """
+    Text waiting to be spoken, its speech rate, and the future that
+    resolves when it has been spoken (True) or interrupted (False).
+    """
+    def __init__(self, text, rate, render_path=None):
+        self.text = text
+        self.rate = rate
+        self.render_path = render_path  # Synthesize to this file instead of playing
+        self.future = Future()
+
+# Dedicated text-to-speech thread
+class TTSWorker:
+    """
+    Owns the pyttsx3 engine on a background thread and speaks queued items
+    in order, so the interaction loop can keep working while Amie talks.
+    The engine is created on that thread and only used there, since some
+    drivers (SAPI5, nsss) are tied to the thread that created them. Each item
+    is spoken with runAndWait(), which every driver supports. Queued and
+    playing speech can be cancelled (barge-in), and the engine rate is only
+    changed when an item needs a different rate than the last one.
+    """
+    def __init__(self, tts_engine):
+        self.engine = tts_engine
+        self.items = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.rate = None
+        self.voice = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    def start(self):
+        """
+        Starts the worker thread if it is not already running and waits
+        (up to TTS_WAIT_TIMEOUT) for it to set up the engine.
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="amie-tts", daemon=True)
+                self.thread.start()
+        if not self.ready.wait(TTS_WAIT_TIMEOUT):
+            print("Text-to-speech engine is still starting; speech is queued until it is ready.")
+
+    def submit(self, text, rate=SPEECH_RATE, render_path=None):
+        """
+        Queues text to be spoken (or rendered to render_path) and returns its completion future.
+        """
+        self.start()
+        item = SpeechItem(text, rate, render_path)
+        with self.lock:
+            self.pending += 1
+            self.idle.clear()
+        self.items.put(item)
+        return item.future
+
+    def _finish(self, item, spoken):
+        """
+        Resolves an item's future and marks the worker idle once the queue is empty.
+        """
+        if item.future.set_running_or_notify_cancel():
+            item.future.set_result(spoken)
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                self.idle.set()
+
+    def _on_word(self, name, location, length):
+        # Called by the driver loop between words; the only safe place to stop it
+        if self.cancel_event.is_set():
+            self.engine.stop()
+
+    def _play(self, item):
+        """
+        Speaks one item and returns False if it was interrupted.
+        Pre-rendered audio is played directly and skips synthesis.
+        """
+        if AUDIO_CACHE_ENABLED and item.render_path is None:
+            cached_files = audio_cache.lookup(item.text, self.voice, item.rate)
+            if cached_files:
+                try:
+                    return all(audio_cache.play(path, self.cancel_event) for path in cached_files)
+                except Exception as e:
+                    # Unplayable cache file or no audio output for it; synthesize instead
+                    print(f"Error playing cached audio: {e}")
+                    audio_cache.discard(cached_files)
+
+        if item.rate != self.rate:
+            self.engine.setProperty("rate", item.rate)
+            self.rate = item.rate
+        if item.render_path:
+            self.engine.save_to_file(item.text, item.render_path)
+        else:
+            self.engine.say(item.text)
+        self.engine.runAndWait()
+        return not self.cancel_event.is_set()
+
+    def _run(self):
+        try:
+            # Creates the engine on this thread
+            self.voice = self.engine.getProperty("voice")
+            self.engine.connect("started-word", self._on_word)
+        except Exception as e:
+            print(f"Error starting text-to-speech: {e}")
+        finally:
+            self.ready.set()
+        while True:
+            item = self.items.get()
+            if item.future.cancelled():
+                self._finish(item, False)
+                continue
+            self.cancel_event.clear()
+            try:
+                spoken = self._play(item)
+            except Exception as e:
+                print(f"Error during text-to-speech: {e}")
+                spoken = False
+            self._finish(item, spoken)
+
+    def cancel_all(self):
+        """
+        Stops the utterance being played and drops everything still queued.
+        """
+        while True:
+            try:
+                item = self.items.get_nowait()
+            except queue.Empty:
+                break
+            item.future.cancel()
+            self._finish(item, False)
+        self.cancel_event.set()
+
+    def is_busy(self):
+        """
+        Returns True while anything is queued or playing.
+        """
+        return not self.idle.is_set()
+
+    def wait_idle(self, timeout=None):
+        """
+        Blocks until all queued speech has been spoken or cancelled.
+        """
+        return self.idle.wait(timeout)
+
+# Shared TTS worker that owns the engine
+tts_worker = TTSWorker(engine)
+
+# Let queued speech finish before the program exits
+atexit.register(lambda: tts_worker.wait_idle(timeout=TTS_WAIT_TIMEOUT))
+
+# Text console used instead of the microphone and speaker in text mode
+class ConsoleIO:
+    """
+    Reads user turns from a text stream and writes Amie's replies to another,
+    so the voice loops can run without any audio device. When the input ends
+    the user is reported as saying goodbye once, then the session is ended.
+    """
+    def __init__(self, input_stream=None, output_stream=None):
+        self.input_stream = input_stream or sys.stdin
+        self.output_stream = output_stream or sys.stdout
+        self.closed = False
+        self.turns = 0
+
+    def say(self, text):
+        self.output_stream.write(f"Amie: {text}\n")
+        self.output_stream.flush()
+        spoken = Future()
+        spoken.set_result(True)
+        return spoken
+
+    def read(self):
+        if self.closed:
+            raise SystemExit(0)
+        self.output_stream.write("You: ")
+        self.output_stream.flush()
+        line = self.input_stream.readline()
+        if not line:
+            # Let the loop run its wrap-up before the program stops
+            self.closed = True
+            self.output_stream.write("\n")
+            return "goodbye"
+        if not self.input_stream.isatty():
+            self.output_stream.write(line if line.endswith("\n") else line + "\n")
+        self.turns += 1
+        return line.strip().lower()
+
+# Set by text mode; when present speak() and listen() use it instead of audio
+console_io = None
+
 # Helper function: Text-to-speech output
 def speak(text, slow=False):
     """
     Converts text to speech for Amie.
     Slows down the speech if the message contains negative or sensitive content.
+    Speech is queued on the TTS worker; the returned future resolves once it has played.
     """
+    if console_io is not None:
+        return console_io.say(text)
     print(f"Amie: {text}")
-    if slow:
-        engine.setProperty("rate", 120)  # Slow down speech for sensitive content
+    return tts_worker.submit(text, SLOW_SPEECH_RATE if slow else SPEECH_RATE)
+
+# Collect every fixed string Amie can say
+def collect_static_utterances():
+    """
+    Returns (text, rate) pairs for all literal SEL prompts plus every literal
+    passed to speak() in this file (including the constant prefix of
+    f"Prefix: {value}" calls), so they can be rendered ahead of time.
+    """
+    utterances = {(prompt, SPEECH_RATE) for prompt in sel_catalog.all_prompts()}
+
+    with open(os.path.abspath(__file__), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and getattr(node.func, "id", None) == "speak" and node.args):
+            continue
+        slow = any(kw.arg == "slow" and getattr(kw.value, "value", False) is True for kw in node.keywords)
+        rate = SLOW_SPEECH_RATE if slow else SPEECH_RATE
+        text = node.args[0]
+        if isinstance(text, ast.Constant) and isinstance(text.value, str):
+            utterances.add((text.value, rate))
+        elif isinstance(text, ast.JoinedStr) and len(text.values) == 2:
+            prefix = text.values[0]
+            if isinstance(prefix, ast.Constant) and prefix.value.endswith(": "):
+                utterances.add((prefix.value.strip(), rate))
+    return sorted(utterances)
+
+# Render the audio cache ahead of time
+def prebuild_audio_cache():
+    """
+    Synthesizes every static utterance that is not cached yet.
+    Returns the number of newly rendered entries.
+    """
+    os.makedirs(audio_cache.directory, exist_ok=True)
+    tts_worker.start()
+    if not tts_worker.wait_idle(timeout=TTS_WAIT_TIMEOUT):
+        print("Speech is still playing; rendering after it.")
+    pending = []
+    for text, rate in collect_static_utterances():
+        if not audio_cache.contains(text, tts_worker.voice, rate):
+            future = tts_worker.submit(text, rate, render_path=audio_cache.path(text, tts_worker.voice, rate))
+            pending.append((text, rate, future))
+    rendered = 0
+    for text, rate, future in pending:
+        try:
+            spoken = future.result(timeout=TTS_WAIT_TIMEOUT)
+        except FutureTimeoutError:
+            print(f"Timed out rendering '{text}'.")
+            continue
+        if spoken and audio_cache.add(text, tts_worker.voice, rate):
+            rendered += 1
+    print(f"Pre-rendered {rendered} of {len(pending)} uncached utterances into {audio_cache.directory}.")
+    return rendered
+
+# Persistent microphone capture settings
+MIC_BUFFER_SECONDS = 30  # Audio kept in the ring buffer
+MIC_PREROLL_SECONDS = 0.3  # Audio from just before a listen call that is handed to it, so first syllables survive
+MIC_CALIBRATION_SECONDS = 1.0  # Ambient audio used to set the energy threshold
+MIC_RECALIBRATION_INTERVAL = 60  # Seconds between background recalibrations
+MIC_MIN_ENERGY_THRESHOLD = 50  # Floor for the calibrated energy threshold
+
+# Energy threshold implied by a stretch of ambient audio
+def ambient_energy_threshold(chunks, sample_width):
+    """
+    Uses the lower quartile of the chunk energies, so a word spoken during
+    the window does not inflate the threshold.
+    """
+    energies = sorted(audioop.rms(chunk, sample_width) for chunk in chunks)
+    ambient = energies[len(energies) // 4]
+    return max(MIC_MIN_ENERGY_THRESHOLD, ambient * recognizer.dynamic_energy_ratio)
+
+# Long-lived microphone stream feeding a ring buffer
+class MicrophoneCapture:
+    """
+    Opens the microphone once and keeps reading it on a background thread
+    into a ring buffer of fixed-size chunks numbered in capture order.
+    Listen calls read from the buffer through BufferedMicrophoneSource
+    instead of reopening the device. The energy threshold is calibrated
+    once at start-up and again periodically while nobody is listening and
+    Amie is not speaking.
+    """
+    def __init__(self, device_factory=sr.Microphone, buffer_seconds=MIC_BUFFER_SECONDS,
+                 recalibration_interval=MIC_RECALIBRATION_INTERVAL):
+        self.device_factory = device_factory
+        self.buffer_seconds = buffer_seconds
+        self.recalibration_interval = recalibration_interval
+        self.chunks = deque()
+        self.next_seq = 0  # Sequence number of the next chunk to be captured
+        self.playback_end_seq = 0  # First chunk captured after Amie last stopped speaking
+        self.condition = threading.Condition()
+        self.ready = threading.Event()
+        self.thread = None
+        self.running = False
+        self.error = None
+        self.sample_rate = None
+        self.sample_width = None
+        self.chunk_size = None
+        self.readers = 0
+        self.last_read_at = 0.0
+        self.last_calibration = 0.0
+        self.calibrations = 0
+        self.overruns = 0
+
+    def start(self):
+        """
+        Opens the device on first use and performs the initial calibration.
+        Raises the capture error if the device failed or the thread died.
+        """
+        with self.condition:
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, name="amie-microphone", daemon=True)
+                self.thread.start()
+                atexit.register(self.stop)
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        if not self.calibrations:
+            self.calibrate()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def _run(self):
+        try:
+            with self.device_factory() as device:
+                self.sample_rate = device.SAMPLE_RATE
+                self.sample_width = device.SAMPLE_WIDTH
+                self.chunk_size = device.CHUNK
+                max_chunks = max(1, int(self.buffer_seconds * self.sample_rate / self.chunk_size))
+                self.ready.set()
+                while self.running:
+                    speaking = tts_worker.is_busy()
+                    data = device.stream.read(self.chunk_size)
+                    speaking = speaking or tts_worker.is_busy()
+                    with self.condition:
+                        self.chunks.append(data)
+                        if len(self.chunks) > max_chunks:
+                            self.chunks.popleft()
+                        self.next_seq += 1
+                        if speaking:
+                            # This chunk may hold Amie's own voice
+                            self.playback_end_seq = self.next_seq
+                        self.condition.notify_all()
+                    if self._should_recalibrate():
+                        self.calibrate()
+        except Exception as e:
+            self.error = e
+            print(f"Error capturing microphone audio: {e}")
+        finally:
+            self.ready.set()
+            self.stop()
+
+    def _should_recalibrate(self):
+        now = time.monotonic()
+        return (
+            self.calibrations
+            and now - self.last_calibration >= self.recalibration_interval
+            and not self.readers
+            and now - self.last_read_at >= MIC_CALIBRATION_SECONDS
+            and not tts_worker.is_busy()
+        )
+
+    def seconds_to_chunks(self, seconds):
+        return max(1, int(round(seconds * self.sample_rate / self.chunk_size)))
+
+    def calibrate(self, duration=MIC_CALIBRATION_SECONDS):
+        """
+        Sets the recognizer's energy threshold from recent ambient audio.
+        Waits for enough audio after start-up.
+        """
+        count = self.seconds_to_chunks(duration)
+        with self.condition:
+            while self.next_seq < count and self.running:
+                self.condition.wait(1)
+            recent = list(self.chunks)[-count:]
+        if not recent:
+            return None
+        recognizer.energy_threshold = ambient_energy_threshold(recent, self.sample_width)
+        self.last_calibration = time.monotonic()
+        self.calibrations += 1
+        return recognizer.energy_threshold
+
+    def read(self, seq):
+        """
+        Returns (chunk, next_seq) for the chunk numbered seq, blocking until it
+        is captured. Readers that fall behind the ring buffer skip ahead.
+        Raises RuntimeError if the capture thread has died.
+        """
+        with self.condition:
+            while seq >= self.next_seq:
+                if self.error is not None:
+                    raise RuntimeError(f"Microphone capture stopped: {self.error}") from self.error
+                if not self.running:
+                    return b"", seq
+                self.condition.wait(1)
+            first_seq = self.next_seq - len(self.chunks)
+            if seq < first_seq:
+                self.overruns += 1
+                seq = first_seq
+            return self.chunks[seq - first_seq], seq + 1
+
+    def open_source(self, preroll=MIC_PREROLL_SECONDS):
+        """
+        Returns an audio source that reads the buffer from just before now.
+        """
+        self.start()
+        return BufferedMicrophoneSource(self, preroll)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "buffered_seconds": len(self.chunks) * self.chunk_size / self.sample_rate if self.sample_rate else 0.0,
+            "calibrations": self.calibrations,
+            "energy_threshold": recognizer.energy_threshold if recognizer.initialized else None,
+            "overruns": self.overruns,
+        }
+
+# speech_recognition audio source backed by the capture ring buffer
+class BufferedMicrophoneSource(sr.AudioSource):
+    """
+    Drop-in replacement for sr.Microphone() in listen calls. Entering it
+    costs nothing: reading starts preroll seconds before the call, but never
+    before the end of Amie's last utterance.
+    """
+    def __init__(self, capture, preroll=MIC_PREROLL_SECONDS):
+        self.capture = capture
+        self.preroll = preroll
+        self.SAMPLE_RATE = capture.sample_rate
+        self.SAMPLE_WIDTH = capture.sample_width
+        self.CHUNK = capture.chunk_size
+        self.stream = None
+
+    class Stream:
+        def __init__(self, capture, seq):
+            self.capture = capture
+            self.seq = seq
+            self.pending = b""
+
+        def read(self, frames):
+            size = frames * self.capture.sample_width
+            while len(self.pending) < size:
+                chunk, self.seq = self.capture.read(self.seq)
+                if not chunk:
+                    break
+                self.pending += chunk
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+
+    def __enter__(self):
+        with self.capture.condition:
+            self.capture.readers += 1
+            start = max(0, self.capture.next_seq - self.capture.seconds_to_chunks(self.preroll),
+                        self.capture.playback_end_seq)
+        self.stream = self.Stream(self.capture, start)
+        return self
+
+    def catch_up(self):
+        """
+        Skips Amie's own speech captured while waiting for her to finish:
+        reading resumes at the first chunk captured after she went quiet.
+        """
+        with self.capture.condition:
+            start = self.capture.playback_end_seq
+        if start > self.stream.seq:
+            self.stream.seq = start
+            self.stream.pending = b""
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stream = None
+        with self.capture.condition:
+            self.capture.readers -= 1
+            self.capture.last_read_at = time.monotonic()
+
+# Shared capture stream, opened the first time Amie listens
+microphone_capture = MicrophoneCapture()
+
+# Speech recognition backend settings
+ASR_BACKEND = os.getenv("AMIE_ASR_BACKEND", "google")  # "google", "vosk" or "sphinx"
+VOSK_MODEL_PATH = os.getenv("AMIE_VOSK_MODEL", "vosk-model-small-en-us-0.15")
+VOSK_SAMPLE_RATE = 16000  # Rate audio is converted to before Vosk sees it
+ASR_LATENCY_WINDOW = 500  # Recent utterances kept for latency percentiles
+ASR_STREAMING = os.getenv("AMIE_ASR_STREAMING", "1") == "1"  # Recognize while the user speaks when the backend can
+
+# Base class for speech-to-text engines
+class RecognitionBackend:
+    """
+    Turns captured AudioData into text. Subclasses implement transcribe()
+    and raise sr.UnknownValueError / sr.RequestError like speech_recognition
+    does. recognize() adds per-utterance latency and real-time factor
+    (recognition time divided by audio length) accounting.
+    Backends that can decode incrementally set supports_streaming and
+    implement open_stream(); for them latency is measured from the end of
+    the phrase to the final result.
+    """
+    name = None
+    supports_streaming = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=ASR_LATENCY_WINDOW)  # (latency, real-time factor)
+        self.utterances = 0
+        self.failures = 0
+        self.audio_seconds = 0.0
+        self.recognition_seconds = 0.0
+
+    def transcribe(self, audio):
+        raise NotImplementedError
+
+    def open_stream(self, sample_rate, sample_width):
+        """
+        Returns an object with accept(chunk) -> new partial text or None,
+        and finish() -> final text.
+        """
+        raise NotImplementedError
+
+    def _record(self, latency, processing, duration, failed):
+        with self.lock:
+            self.utterances += 1
+            self.failures += failed
+            self.audio_seconds += duration
+            self.recognition_seconds += processing
+            self.recent.append((latency, processing / duration if duration else 0.0))
+
+    def recognize(self, audio):
+        duration = len(audio.frame_data) / float(audio.sample_rate * audio.sample_width)
+        start = time.perf_counter()
+        failed = True
+        try:
+            text = self.transcribe(audio)
+            failed = False
+            return text
+        finally:
+            latency = time.perf_counter() - start
+            self._record(latency, latency, duration, failed)
+
+    def recognize_stream(self, chunks, sample_rate, sample_width, on_partial=None):
+        """
+        Decodes audio chunks as they arrive, passing each changed partial
+        hypothesis to on_partial, and returns the final text.
+        """
+        decoder = self.open_stream(sample_rate, sample_width)
+        processing = 0.0
+        audio_bytes = 0
+        failed = True
+        latency = 0.0
+        try:
+            for chunk in chunks:
+                audio_bytes += len(chunk)
+                start = time.perf_counter()
+                partial = decoder.accept(chunk)
+                processing += time.perf_counter() - start
+                if partial and on_partial is not None:
+                    on_partial(partial)
+            start = time.perf_counter()
+            text = decoder.finish()
+            latency = time.perf_counter() - start
+            processing += latency
+            failed = False
+            return text
+        finally:
+            self._record(latency, processing, audio_bytes / float(sample_rate * sample_width), failed)
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(latency for latency, _ in self.recent)
+            return {
+                "backend": self.name,
+                "utterances": self.utterances,
+                "failures": self.failures,
+                "p50_latency_ms": 1000 * latencies[len(latencies) // 2] if latencies else 0.0,
+                "p95_latency_ms": 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+                "real_time_factor": self.recognition_seconds / self.audio_seconds if self.audio_seconds else 0.0,
+                "last_real_time_factor": self.recent[-1][1] if self.recent else 0.0,
+            }
+
+# Google Web Speech API (network)
+class GoogleRecognitionBackend(RecognitionBackend):
+    name = "google"
+
+    def transcribe(self, audio):
+        return recognizer.recognize_google(audio)
+
+# Vosk (offline, CPU-only)
+class VoskRecognitionBackend(RecognitionBackend):
+    """
+    Runs a local Vosk/Kaldi model, so recognition needs no network and its
+    latency depends only on the CPU and the utterance length.
+    """
+    name = "vosk"
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        super().__init__()
+        if vosk is None:
+            raise RuntimeError("The vosk recognition backend requires the vosk package.")
+        if not os.path.isdir(model_path):
+            raise RuntimeError(f"Vosk model not found at {model_path}; set AMIE_VOSK_MODEL.")
+        vosk.SetLogLevel(-1)
+        self.model = vosk.Model(model_path)
+
+    supports_streaming = True
+
+    def transcribe(self, audio):
+        decoder = vosk.KaldiRecognizer(self.model, VOSK_SAMPLE_RATE)
+        decoder.AcceptWaveform(audio.get_raw_data(convert_rate=VOSK_SAMPLE_RATE, convert_width=2))
+        text = json.loads(decoder.FinalResult()).get("text", "")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    def open_stream(self, sample_rate, sample_width):
+        return VoskStream(self.model, sample_rate, sample_width)
+
+# Incremental Vosk decoder for one phrase
+class VoskStream:
+    """
+    Converts each captured chunk to 16-bit audio at the model's rate and
+    feeds it to a KaldiRecognizer, surfacing partial hypotheses as they change.
+    """
+    def __init__(self, model, sample_rate, sample_width):
+        self.decoder = vosk.KaldiRecognizer(model, VOSK_SAMPLE_RATE)
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.resample_state = None
+        self.segments = []  # Text of segments Vosk has already finalized
+        self.partial = ""
+
+    def accept(self, chunk):
+        if self.sample_width != 2:
+            chunk = audioop.lin2lin(chunk, self.sample_width, 2)
+        if self.sample_rate != VOSK_SAMPLE_RATE:
+            chunk, self.resample_state = audioop.ratecv(
+                chunk, 2, 1, self.sample_rate, VOSK_SAMPLE_RATE, self.resample_state
+            )
+        if self.decoder.AcceptWaveform(chunk):
+            segment = json.loads(self.decoder.Result()).get("text", "")
+            if segment:
+                self.segments.append(segment)
+            partial = ""
+        else:
+            partial = json.loads(self.decoder.PartialResult()).get("partial", "")
+        hypothesis = " ".join(self.segments + ([partial] if partial else []))
+        if hypothesis and hypothesis != self.partial:
+            self.partial = hypothesis
+            return hypothesis
+        return None
+
+    def finish(self):
+        segment = json.loads(self.decoder.FinalResult()).get("text", "")
+        text = " ".join(self.segments + ([segment] if segment else []))
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+# CMU Sphinx via pocketsphinx (offline, CPU-only)
+class SphinxRecognitionBackend(RecognitionBackend):
+    name = "sphinx"
+
+    def transcribe(self, audio):
+        return recognizer.recognize_sphinx(audio)
+
+ASR_BACKENDS = {
+    "google": GoogleRecognitionBackend,
+    "vosk": VoskRecognitionBackend,
+    "sphinx": SphinxRecognitionBackend,
+}
+
+# Build the backend selected for this deployment
+def create_asr_backend(name=ASR_BACKEND):
+    if name not in ASR_BACKENDS:
+        raise ValueError(f"Unknown speech recognition backend '{name}'; choose from {', '.join(ASR_BACKENDS)}.")
+    return ASR_BACKENDS[name]()
+
+# Shared recognition backend, created (and its model loaded) on first use
+asr_backend = LazyResource("asr_backend", create_asr_backend)
+
+# Voice activity detection settings
+VAD_FRAME_SECONDS = 0.02  # Length of each analysed frame
+VAD_TRAILING_SILENCE = float(os.getenv("AMIE_VAD_TRAILING_SILENCE", "0.5"))  # Non-speech that ends a turn
+VAD_START_FRAMES = 3  # Consecutive speech frames that start a phrase
+VAD_NOISE_ZCR = 0.25  # Zero crossings per sample above which a frame sounds like broadband noise
+VAD_NOISY_ENERGY_RATIO = 3.0  # Energy, relative to the threshold, that noise-like frames need to count as speech
+
+# Frame-level speech/non-speech classification
+class VoiceActivityDetector:
+    """
+    Splits audio into short frames and marks each as speech when its RMS
+    energy is above the threshold. Frames with a noise-like zero-crossing
+    rate (fans, rustling, clicks) must be several times louder to count, so
+    background bursts don't hold a turn open. Frames are analysed together
+    with numpy when it is installed.
+    """
+    NUMPY_DTYPES = {2: "<i2", 4: "<i4"}
+
+    def __init__(self, sample_rate, sample_width, frame_seconds=VAD_FRAME_SECONDS):
+        self.sample_width = sample_width
+        self.frame_samples = max(1, int(sample_rate * frame_seconds))
+        self.frame_seconds = float(self.frame_samples) / sample_rate
+        self.frame_bytes = self.frame_samples * sample_width
+        self.pending = b""
+
+    def _measure(self, data):
+        """
+        Returns per-frame (energies, zero-crossing rates) for whole frames of data.
+        """
+        dtype = self.NUMPY_DTYPES.get(self.sample_width)
+        if numpy is not None and dtype:
+            samples = numpy.frombuffer(data, dtype=dtype).reshape(-1, self.frame_samples).astype(numpy.float64)
+            energies = numpy.sqrt(numpy.mean(samples * samples, axis=1))
+            signs = numpy.signbit(samples)
+            rates = numpy.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(self.frame_samples)
+            return energies, rates
+        frames = [data[i:i + self.frame_bytes] for i in range(0, len(data), self.frame_bytes)]
+        energies = [audioop.rms(frame, self.sample_width) for frame in frames]
+        rates = [audioop.cross(frame, self.sample_width) / float(self.frame_samples) for frame in frames]
+        return energies, rates
+
+    def classify(self, chunk, energy_threshold):
+        """
+        Returns a speech flag for every complete frame available after adding chunk.
+        """
+        data = self.pending + chunk
+        usable = len(data) - len(data) % self.frame_bytes
+        self.pending = data[usable:]
+        if not usable:
+            return []
+        energies, rates = self._measure(data[:usable])
+        noisy_threshold = energy_threshold * VAD_NOISY_ENERGY_RATIO
+        return [
+            bool(energy > (noisy_threshold if rate > VAD_NOISE_ZCR else energy_threshold))
+            for energy, rate in zip(energies, rates)
+        ]
+
+# Yield one phrase of audio while it is being spoken
+def capture_phrase_chunks(source, timeout=None, phrase_time_limit=None, trailing_silence=VAD_TRAILING_SILENCE,
+                          timings=None):
+    """
+    Yields the raw chunks of one phrase as soon as they are captured. The
+    phrase starts after VAD_START_FRAMES consecutive speech frames (the
+    last non_speaking_duration of audio before that is included) and ends
+    after trailing_silence seconds without speech, or at phrase_time_limit.
+    Raises sr.WaitTimeoutError if no speech starts within timeout seconds.
+    If a timings dict is passed it receives onset: the seconds of audio
+    before speech started.
+    """
+    seconds_per_chunk = float(source.CHUNK) / source.SAMPLE_RATE
+    vad = VoiceActivityDetector(source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+    trailing_frames = max(1, int(math.ceil(trailing_silence / vad.frame_seconds)))
+    leading = deque(maxlen=max(1, int(math.ceil(recognizer.non_speaking_duration / seconds_per_chunk))))
+    waited = 0.0
+    speech_frames = 0
+    while speech_frames < VAD_START_FRAMES:
+        waited += seconds_per_chunk
+        if timeout and waited > timeout:
+            raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+        chunk = source.stream.read(source.CHUNK)
+        if not chunk:
+            return
+        leading.append(chunk)
+        for is_speech in vad.classify(chunk, recognizer.energy_threshold):
+            speech_frames = speech_frames + 1 if is_speech else 0
+            if speech_frames >= VAD_START_FRAMES:
+                break
+    if timings is not None:
+        timings["onset"] = waited
+    yield from leading
+
+    elapsed = 0.0
+    silent_frames = 0
+    while silent_frames < trailing_frames:
+        elapsed += seconds_per_chunk
+        if phrase_time_limit and elapsed > phrase_time_limit:
+            return
+        chunk = source.stream.read(source.CHUNK)
+        if not chunk:
+            return
+        yield chunk
+        for is_speech in vad.classify(chunk, recognizer.energy_threshold):
+            silent_frames = 0 if is_speech else silent_frames + 1
+
+# Record and transcribe one phrase from an open source
+def recognize_phrase(source, timeout=None, phrase_time_limit=None, timings=None):
+    """
+    Returns the text of the next phrase, ended by voice activity detection.
+    Streaming backends decode while the user is still talking, so the final
+    text is ready right after they stop; others receive the whole recording
+    once the phrase has ended.
+    """
+    chunks = capture_phrase_chunks(source, timeout, phrase_time_limit, timings=timings)
+    if ASR_STREAMING and asr_backend.supports_streaming:
+        return asr_backend.recognize_stream(
+            chunks, source.SAMPLE_RATE, source.SAMPLE_WIDTH,
+            on_partial=lambda partial: print(f"(hearing) {partial}")
+        )
+    audio = sr.AudioData(b"".join(chunks), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+    if not audio.frame_data:
+        raise sr.UnknownValueError()
+    return asr_backend.recognize(audio)
+
+# Turn-gap measurement settings
+TURN_GAP_CHUNK = 1024  # Frames per read, matching the microphone
+TURN_GAP_CALIBRATION_SECONDS = 0.5  # Leading audio of each recording treated as ambient noise
+TURN_GAP_REFERENCE_SILENCE = 1.0  # Non-speech after which the reference end of speech is placed
+
+# Reference end of speech in a recording
+def reference_speech_end(flags, frame_seconds):
+    """
+    Returns the end of the last speech frame before TURN_GAP_REFERENCE_SILENCE
+    of non-speech, in seconds, or None if the recording has no speech.
+    """
+    gap_frames = int(TURN_GAP_REFERENCE_SILENCE / frame_seconds)
+    last_speech = None
+    for index, is_speech in enumerate(flags):
+        if is_speech:
+            last_speech = index
+        elif last_speech is not None and index - last_speech >= gap_frames:
+            break
+    return (last_speech + 1) * frame_seconds if last_speech is not None else None
+
+# Compare end-of-turn detection on recorded audio
+def measure_turn_gaps(wav_paths, timeout=10):
+    """
+    Replays each recording through the old endpointing (recognizer.listen
+    with phrase_time_limit=timeout) and through VAD endpointing, and reports
+    how long after the end of speech each one stopped listening. Entries are
+    paths or (path, speech_end_seconds) pairs; without an annotation the end
+    of speech is the last speech frame before TURN_GAP_REFERENCE_SILENCE of
+    non-speech. Each recording should start with TURN_GAP_CALIBRATION_SECONDS
+    of silence.
+    """
+    class CountingStream:
+        def __init__(self, stream):
+            self.stream = stream
+            self.bytes_read = 0
+
+        def read(self, frames):
+            data = self.stream.read(frames)
+            self.bytes_read += len(data)
+            return data
+
+    def consumed_seconds(path, endpoint):
+        with sr.AudioFile(path) as source:
+            source.CHUNK = TURN_GAP_CHUNK
+            source.stream = CountingStream(source.stream)
+            try:
+                endpoint(source)
+            except sr.WaitTimeoutError:
+                return None
+            return source.stream.bytes_read / float(source.SAMPLE_RATE * source.SAMPLE_WIDTH)
+
+    saved = (recognizer.energy_threshold, recognizer.dynamic_energy_threshold)
+    recognizer.dynamic_energy_threshold = False
+    gaps = []
+    try:
+        for entry in wav_paths:
+            path, speech_end = entry if isinstance(entry, (tuple, list)) else (entry, None)
+            with sr.AudioFile(path) as source:
+                audio = b"".join(iter(lambda: source.stream.read(TURN_GAP_CHUNK), b""))
+                vad = VoiceActivityDetector(source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+                calibration_bytes = int(TURN_GAP_CALIBRATION_SECONDS * source.SAMPLE_RATE) * source.SAMPLE_WIDTH
+                ambient = [audio[i:i + vad.frame_bytes] for i in range(0, calibration_bytes, vad.frame_bytes)]
+                recognizer.energy_threshold = ambient_energy_threshold(ambient, source.SAMPLE_WIDTH)
+                flags = vad.classify(audio, recognizer.energy_threshold)
+            if speech_end is None:
+                speech_end = reference_speech_end(flags, vad.frame_seconds)
+            if speech_end is None:
+                continue
+            before = consumed_seconds(path, lambda source: recognizer.listen(
+                source, timeout=timeout, phrase_time_limit=timeout))
+            after = consumed_seconds(path, lambda source: list(capture_phrase_chunks(source, timeout, timeout)))
+            gaps.append({
+                "path": path,
+                "speech_end": speech_end,
+                "fixed_gap": before - speech_end if before is not None else None,
+                "vad_gap": after - speech_end if after is not None else None,
+            })
+    finally:
+        recognizer.energy_threshold, recognizer.dynamic_energy_threshold = saved
+
+    def median_ms(key):
+        values = sorted(gap[key] for gap in gaps if gap[key] is not None)
+        return 1000 * values[len(values) // 2] if values else None
+
+    results = {
+        "recordings": len(gaps),
+        "median_fixed_gap_ms": median_ms("fixed_gap"),
+        "median_vad_gap_ms": median_ms("vad_gap"),
+        "turns": gaps,
+    }
+    print(f"Turn gaps: fixed {results['median_fixed_gap_ms']} ms, VAD {results['median_vad_gap_ms']} ms "
+          f"over {results['recordings']} recordings")
+    return results
+
+# Helper function: Wait for Amie to finish talking before taking the user's turn
+def wait_for_turn(source):
+    """
+    Blocks until queued speech has finished playing. With barge-in enabled,
+    the user starting to talk over Amie cancels the remaining speech instead.
+    """
+    if not BARGE_IN_ENABLED:
+        if not tts_worker.wait_idle(timeout=TTS_WAIT_TIMEOUT):
+            print(f"Speech did not finish within {TTS_WAIT_TIMEOUT} seconds; listening anyway.")
+        return
+    loud_frames = 0
+    while tts_worker.is_busy():
+        buffer = source.stream.read(source.CHUNK)
+        energy = audioop.rms(buffer, source.SAMPLE_WIDTH)
+        if energy > recognizer.energy_threshold * BARGE_IN_ENERGY_RATIO:
+            loud_frames += 1
+        else:
+            loud_frames = 0
+        if loud_frames >= BARGE_IN_FRAMES:
+            print("User started talking; stopping speech.")
+            tts_worker.cancel_all()
+            break
+
+# Sentence boundary: end punctuation, optional closing quotes/brackets, then whitespace
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?\u2026])[\"'\u201d\u2019)\]]*\s+")
+
+# Incremental sentence splitter for streamed text
+class SentenceChunker:
+    """
+    Buffers streamed text and hands back complete sentences as soon as
+    their closing punctuation and following whitespace have arrived.
+    """
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        """
+        Adds text and returns any sentences it completed.
+        """
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self.buffer):
+            sentence = self.buffer[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """
+        Returns whatever is left once the stream has ended.
+        """
+        remainder, self.buffer = self.buffer.strip(), ""
+        return [remainder] if remainder else []
+
+# Time from starting a pipelined reply to its first sentence reaching TTS
+speech_pipeline_metrics = StreamMetrics()
+
+# Helper function: Speak a streamed response sentence by sentence
+def speak_stream(chunks, slow=False):
+    """
+    Speaks text while it is still being generated. Chunks (e.g. from
+    generate_response_stream) are split into sentences, and each finished
+    sentence is queued on the TTS worker while later ones are still being produced.
+    Returns the full text once generation has finished.
+    """
+    start = time.perf_counter()
+    first_sentence_at = None
+    chunker = SentenceChunker()
+    spoken = []
+    last_future = None
+
+    def queue_sentences(sentences):
+        nonlocal first_sentence_at, last_future
+        for sentence in sentences:
+            if first_sentence_at is None:
+                first_sentence_at = time.perf_counter()
+            last_future = speak(sentence, slow=slow)
+            spoken.append(sentence)
+
+    for chunk in chunks:
+        queue_sentences(chunker.feed(chunk))
+    queue_sentences(chunker.flush())
+
+    def record(future=None):
+        end = time.perf_counter()
+        speech_pipeline_metrics.record((first_sentence_at or end) - start, end - start)
+
+    # Total time runs until the last sentence has been spoken
+    if last_future is None:
+        record()
     else:
-        engine.setProperty("rate", 150)
-    engine.say(text)
-    engine.runAndWait()
+        last_future.add_done_callback(record)
+    return " ".join(spoken)
 
 # Helper function: Recognize user speech input
 def listen():
@@ -134,12 +2802,14 @@ def listen():
     Captures and transcribes user speech using the microphone.
     Returns the transcribed text or handles errors gracefully if no input is detected.
     """
-    with sr.Microphone() as source:
-        recognizer.energy_threshold = 300  # Adjust for ambient noise
+    if console_io is not None:
+        return console_io.read()
+    with microphone_capture.open_source() as source:
+        wait_for_turn(source)
+        source.catch_up()
         print("Listening... Please speak.")
         try:
-            audio = recognizer.listen(source, timeout=10, phrase_time_limit=8)  # Timeout set to 10 seconds
-            user_input = recognizer.recognize_google(audio)
+            user_input = recognize_phrase(source, timeout=10, phrase_time_limit=8)  # Timeout set to 10 seconds
             print(f"User: {user_input}")
             return user_input.lower()
         except sr.UnknownValueError:
@@ -166,22 +2836,17 @@ def get_age_prompt(age):
     """
     Returns a set of predefined prompts based on the user's age group.
     """
-    if age <= 12:
-        return SEL_PROMPTS["child"]
-    elif age <= 18:
-        return SEL_PROMPTS["teen"]
-    else:
-        return SEL_PROMPTS["adult"]
+    return sel_catalog.get(SELPromptCatalog.age_band(age), "general")
 
 # Main function: Initiates conversation and handles user interactions
-def main():
+def basic_conversation_loop():
     """
     Core chatbot function to manage the conversation flow.
     Handles user name, age, and provides empathetic, age-appropriate interactions.
     """
     speak("Hello, I am Amie. May I know who I am speaking to?")
-    time.sleep(10) # Wait for 5 seconds
-    conversation_history = [{"role": "system", "content": "You are a helpful, empathetic chatbot."}]
+    if console_io is None:
+        time.sleep(10)  # Give the user 10 seconds to get ready; text mode runs at CPU speed
     name = None
     age = None
 
@@ -216,21 +2881,21 @@ def main():
         # Handle user silence: Provide a secondary prompt if no response
         if not user_input:
             speak("I noticed you're quiet. Let me ask you this:")
-            prompt = random.choice(get_age_prompt(age))  # Select a new prompt based on age
+            prompt = draw_sel_prompt(SELPromptCatalog.age_band(age))  # Select a new prompt based on age
             speak(prompt)
             continue
 
         # Emotion-aware responses: Analyze input for emotional context
-        if any(neg_word in user_input for neg_word in NEGATIVE_KEYWORDS):
+        matched = keyword_matcher.classify(user_input)
+        if matched["negative"]:
             speak("It sounds like you're feeling upset. I'm here to listen. Would you like to share more?", slow=True)
             continue
-        elif any(pos_word in user_input for pos_word in POSITIVE_KEYWORDS):
+        elif matched["positive"]:
             speak("I'm so glad to hear that! What else is making you feel good today?")
             continue
 
         # Dynamic response generation
-        response = generate_response(user_input, conversation_history)
-        speak(response)
+        speak_stream(generate_response_stream(user_input))
 
         # Suggest a Social Emotional Learning (SEL) scenario if conversation slows
         if user_input in ["i don't know", "not sure", "nothing"]:
@@ -247,7 +2912,7 @@ def suggest_scenario(age):
     Suggests and narrates an SEL scenario relevant to the user's age group,
     encouraging engagement and self-reflection.
     """
-    prompt = random.choice(get_age_prompt(age))
+    prompt = draw_sel_prompt(SELPromptCatalog.age_band(age))
     speak(f"Here's something to think about: {prompt}")
     if age <= 12:
         speak("Take your time to think and tell me what you'd do.")
@@ -276,9 +2941,10 @@ def handle_emotional_response(user_input, age):
     Adjusts tone and content of responses based on the user's emotions,
     providing tailored encouragement or support.
     """
-    if any(word in user_input for word in NEGATIVE_KEYWORDS):
+    matched = keyword_matcher.classify(user_input)
+    if matched["negative"]:
         speak("I'm really sorry you're feeling this way. You're not alone, and I'm here for you.", slow=True)
-    elif any(word in user_input for word in POSITIVE_KEYWORDS):
+    elif matched["positive"]:
         if age <= 12:
             speak("That's so great to hear! What's another fun thing you like to do?")
         elif age <= 18:
@@ -292,14 +2958,19 @@ def handle_emotional_response(user_input, age):
 def log_conversation(conversation_log):
     """
     Logs the conversation history for debugging or future training purposes.
+    Records are queued as JSON lines on the background log sink.
     """
-    try:
-        with open("conversation_log.txt", "a") as log_file:
-            for entry in conversation_log:
-                log_file.write(f"{entry['role']}: {entry['content']}\n")
-            log_file.write("\n--- End of Conversation ---\n")
-    except IOError as e:
-        print(f"Error logging conversation: {e}")
+    session_id = getattr(conversation_log, "session_id", None)
+    timestamp = time.time()
+    for entry in conversation_log:
+        conversation_sink.emit({
+            "ts": timestamp,
+            "type": "turn",
+            "session_id": session_id,
+            "role": entry["role"],
+            "content": entry["content"],
+        })
+    conversation_sink.emit({"ts": timestamp, "type": "end", "session_id": session_id})
 # Modular function for handling contextual suggestions
 def suggest_followup(response_type, age):
     """
@@ -362,13 +3033,13 @@ def multi_turn_scenario(age):
                 speak("It's inspiring to see how much you care about others' well-being.")
 
 # Modular helper for re-engaging disengaged users
-def reengage_user(age):
+def reengage_user(age, conversation_log=None):
     """
     Provides a tailored re-engagement strategy for users who seem less responsive
     or are disengaged from the conversation.
     """
     speak("I noticed it's been a bit quiet. Here's something you can think about:")
-    prompt = random.choice(get_age_prompt(age))
+    prompt = draw_sel_prompt(SELPromptCatalog.age_band(age), conversation_log=conversation_log)
     speak(prompt)
 
 # Helper function to validate user age input
@@ -382,13 +3053,6 @@ def validate_age_input(user_input):
             return age
     return None
 
-# Main entry point for program execution
-if __name__ == "__main__":
-    try:
-        main()
-    except Exception as e:
-        handle_error(e)
-
 # Social-Emotional Reflection Prompts
 SEL_REFLECTION_PROMPTS = {
     "gratitude": [
@@ -413,8 +3077,8 @@ def initiate_reflection(category, age):
     """
     Starts a reflection activity based on a specific SEL category.
     """
-    if category in SEL_REFLECTION_PROMPTS:
-        prompt = random.choice(SEL_REFLECTION_PROMPTS[category])
+    if sel_catalog.get(ANY_AGE, category):
+        prompt = draw_sel_prompt(ANY_AGE, category)
         speak(f"Here's something to reflect on: {prompt}")
         user_response = listen()
         if user_response:
@@ -434,6 +3098,8 @@ def update_conversation_memory(conversation_log, user_input, response):
     """
     conversation_log.append({"role": "user", "content": user_input})
     conversation_log.append({"role": "assistant", "content": response})
+    if DEBUG_LOG_ENABLED:
+        log_debugging_data(conversation_log, "turn")
 
 # Function to provide advanced SEL scenarios with branching paths
 def advanced_sel_scenario(age):
@@ -482,6 +3148,7 @@ def generate_sel_response(user_input, category, age):
         prompt = f"Provide an empathetic and age-appropriate response for the SEL category '{category}'. User said: '{user_input}'"
         conversation_history = [{"role": "system", "content": "You are a helpful, empathetic assistant."}]
         conversation_history.append({"role": "user", "content": prompt})
+        require_openai_key()
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
             messages=conversation_history,
@@ -529,11 +3196,12 @@ def rotate_sel_prompts(conversation_log, age):
     Cycles through a predefined set of SEL prompts to maintain variety and
     engagement across multiple interactions.
     """
-    used_prompts = [entry["content"] for entry in conversation_log if entry["role"] == "assistant"]
-    available_prompts = [p for p in get_age_prompt(age) if p not in used_prompts]
+    prompt = conversation_log.sampler().draw(
+        SELPromptCatalog.age_band(age), "general", refill=False, exclude=conversation_log.used_prompts
+    )
 
-    if available_prompts:
-        prompt = random.choice(available_prompts)
+    if prompt:
+        conversation_log.mark_prompt_used(prompt)
         speak(f"Here’s a question for you: {prompt}")
     else:
         speak("It seems we’ve covered a lot of topics. Is there something specific you’d like to talk about?")
@@ -551,12 +3219,12 @@ def log_and_terminate(conversation_log):
         speak("Goodbye for now! I'll see you next time.")
 
 # Final main function for session integration
-def main():
+def sel_rotation_loop():
     """
     Executes the chatbot session, including dynamic responses, SEL interactions,
     and session handling.
     """
-    conversation_log = []
+    conversation_log = Session()
     speak("Hi there! I’m Amie, your friendly chatbot. Can you tell me your name?")
     name = None
     age = None
@@ -567,7 +3235,7 @@ def main():
 
             # Handle empty input
             if not user_input:
-                reengage_user(age)
+                reengage_user(age, conversation_log)
                 continue
 
             # Quit if user requests
@@ -606,34 +3274,29 @@ def main():
 def save_user_preferences(name, age):
     """
     Saves user preferences (name and age) for future sessions.
-    Data is stored in a simple local file named 'user_preferences.json'.
+    Data is kept per user in the shared user store.
     """
-    import json
-
     user_data = {"name": name, "age": age}
-    try:
-        with open("user_preferences.json", "w") as f:
-            json.dump(user_data, f)
-        print("User preferences saved successfully.")
-    except IOError as e:
-        print(f"Error saving user preferences: {e}")
+    conversation_sink.emit({"ts": time.time(), "type": "preferences", **user_data})
+    remember_user(name, age)
+    print("User preferences saved successfully.")
 
 # Function to load user preferences
 def load_user_preferences():
     """
-    Loads user preferences (name and age) from 'user_preferences.json' if available.
-    Returns the data or None if the file doesn't exist or has errors.
+    Loads the most recent user's preferences (name and age) from the user store.
+    Returns the data or None if no user has been saved yet.
     """
-    import json
-
     try:
-        with open("user_preferences.json", "r") as f:
-            user_data = json.load(f)
-        print("User preferences loaded successfully.")
-        return user_data
-    except (IOError, json.JSONDecodeError) as e:
+        record = load_last_user()
+    except sqlite3.Error as e:
         print(f"Error loading user preferences: {e}")
         return None
+    if not record:
+        print("No saved user preferences found.")
+        return None
+    print("User preferences loaded successfully.")
+    return dict(record["profile"], preferences=record["preferences"])
 
 # Enhanced emotion-based SEL scenarios
 def emotion_branching_scenario(user_input, age):
@@ -641,7 +3304,8 @@ def emotion_branching_scenario(user_input, age):
     Guides the conversation based on emotional keywords in the user's input.
     Provides tailored prompts for negative and positive emotions.
     """
-    if any(word in user_input for word in NEGATIVE_KEYWORDS):
+    matched = keyword_matcher.classify(user_input)
+    if matched["negative"]:
         speak("I’m sorry you’re feeling this way. Would you like to tell me more?")
         followup = listen()
         if followup:
@@ -651,7 +3315,7 @@ def emotion_branching_scenario(user_input, age):
                 speak("That’s tough. What are some things you usually do to feel better?")
             else:
                 speak("It’s okay to feel this way. Sometimes sharing with a trusted person can help.")
-    elif any(word in user_input for word in POSITIVE_KEYWORDS):
+    elif matched["positive"]:
         speak("That’s wonderful! Let’s keep the good vibes going.")
         if age <= 12:
             speak("What’s one thing that made you laugh today?")
@@ -709,9 +3373,10 @@ def provide_feedback(user_input):
     """
     Provides immediate feedback to the user based on the tone of their input.
     """
-    if any(word in user_input for word in NEGATIVE_KEYWORDS):
+    matched = keyword_matcher.classify(user_input)
+    if matched["negative"]:
         speak("You’re doing great by sharing how you feel. What’s one small thing that could help right now?")
-    elif any(word in user_input for word in POSITIVE_KEYWORDS):
+    elif matched["positive"]:
         speak("I’m glad to hear that! Let’s keep the good energy going.")
     else:
         speak("That’s interesting! Can you tell me more?")
@@ -730,15 +3395,32 @@ def reengage_with_memory(name, age):
 def log_debugging_data(conversation_log, event_type):
     """
     Logs detailed debugging information, including conversation context and events.
-    """
-    try:
-        with open("debug_log.txt", "a") as debug_file:
-            debug_file.write(f"Event: {event_type}\n")
-            for entry in conversation_log:
-                debug_file.write(f"{entry['role']}: {entry['content']}\n")
-            debug_file.write("\n--- End of Debug Data ---\n")
-    except IOError as e:
-        print(f"Error logging debugging data: {e}")
+    Only entries appended since the session's previous event are written, tagged
+    with the session id and a sequence number; reconstruct_debug_state replays them.
+    A full snapshot is written the first time, and whenever the log was edited
+    other than by appending.
+    """
+    if not isinstance(conversation_log, Session):
+        # Plain lists can't carry a cursor, so they are always logged in full
+        conversation_log = Session(conversation_log)
+
+    seq = conversation_log.debug_seq + 1
+    full = seq == 1 or conversation_log.debug_revision != conversation_log.revision
+    start = 0 if full else conversation_log.debug_cursor
+    debug_sink.emit({
+        "ts": time.time(),
+        "session_id": conversation_log.session_id,
+        "seq": seq,
+        "type": "snapshot" if full else "delta",
+        "event": event_type,
+        "entries": [
+            {"index": index, "role": entry["role"], "content": entry["content"]}
+            for index, entry in enumerate(conversation_log[start:], start)
+        ],
+    })
+    conversation_log.debug_seq = seq
+    conversation_log.debug_cursor = len(conversation_log)
+    conversation_log.debug_revision = conversation_log.revision
 
 # Refined session end logic with memory update
 def end_session_with_memory(conversation_log, name, age):
@@ -746,6 +3428,8 @@ def end_session_with_memory(conversation_log, name, age):
     Ends the session gracefully, logs the conversation, and saves user preferences.
     """
     log_conversation(conversation_log)
+    if DEBUG_LOG_ENABLED:
+        log_debugging_data(conversation_log, "session_end")
     if name and age:
         save_user_preferences(name, age)
     speak("It was so nice talking to you today. Have a wonderful day!")
@@ -760,6 +3444,9 @@ def guided_goal_setting(name, age):
     user_response = listen()
 
     if user_response:
+        user_store.update(user_id_for(name), lambda record: record["goals"].append(
+            {"goal": user_response, "status": "set", "created_at": time.time()}
+        ))
         if age <= 12:
             speak("That’s a great goal! What’s one small step you can take to get started?")
         elif age <= 18:
@@ -814,37 +3501,30 @@ def update_user_memory(name, age, preferences=None):
     """
     Updates the user's memory with customizable preferences.
     """
-    import json
-
     user_data = {"name": name, "age": age, "preferences": preferences or {}}
-    try:
-        with open("user_preferences.json", "w") as f:
-            json.dump(user_data, f)
-        print("User memory updated successfully.")
-    except IOError as e:
-        print(f"Error updating user memory: {e}")
+    conversation_sink.emit({"ts": time.time(), "type": "preferences", **user_data})
+    remember_user(name, age, preferences)
+    print("User memory updated successfully.")
 
 # Load memory with fallback handling
-def load_memory_with_fallback(file_path="user_preferences.json"):
+def load_memory_with_fallback(file_path=None):
     """
-    Load user memory from a JSON file. If the file is missing, return default values.
+    Load the most recent user's memory from the user store. If nobody has been
+    saved yet, return default values. A legacy preferences file at file_path
+    (by default the one the store was created with) is imported into an empty store.
     """
     try:
-        # Attempt to open and load the user preferences file
-        with open(file_path, "r") as f:
-            memory = json.load(f)
-            # Extract name and age from the memory
-            name = memory.get("name", "there")  # Default to "there" if no name is found
-            age = memory.get("age")  # Age may be None if not provided
-            return name, age
-    except FileNotFoundError:
-        # Handle the case where the file does not exist
-        print(f"Error loading user preferences: {file_path} not found. Using defaults.")
+        user_store.import_legacy_file(file_path)
+        record = load_last_user()
+    except sqlite3.Error as e:
+        print(f"Error loading user preferences: {e}. Using defaults.")
         return "Guest", None
-    except json.JSONDecodeError:
-        # Handle the case where the file exists but contains invalid JSON
-        print(f"Error loading user preferences: {file_path} contains invalid JSON. Using defaults.")
+    if not record:
+        print("No saved user preferences found. Using defaults.")
         return "Guest", None
+    name = record["profile"].get("name") or "there"  # Default to "there" if no name is found
+    age = record["profile"].get("age")  # Age may be None if not provided
+    return name, age
 
 # Context-aware re-engagement
 def context_aware_reengagement(conversation_log, name, age):
@@ -920,8 +3600,8 @@ def expanded_sel_exercise(category, age):
     """
     Facilitates advanced SEL exercises from expanded categories.
     """
-    if category in EXPANDED_SEL_CATEGORIES:
-        prompt = random.choice(EXPANDED_SEL_CATEGORIES[category])
+    if sel_catalog.get(ANY_AGE, category):
+        prompt = draw_sel_prompt(ANY_AGE, category)
         speak(f"Let’s think about this: {prompt}")
         user_response = listen()
         if user_response:
@@ -1033,7 +3713,7 @@ def summarize_session(conversation_log, name, goals):
     Summarizes the session, including user progress and SEL achievements.
     """
     speak(f"{name}, here’s what we’ve covered today:")
-    for entry in conversation_log:
+    for entry in conversation_log.dialogue:
         if entry["role"] == "user":
             speak(f"You shared: {entry['content']}")
         elif entry["role"] == "assistant":
@@ -1063,7 +3743,8 @@ def emotion_adaptive_scenario(user_input, age):
     Adjusts the SEL scenario based on the emotional tone detected in the user's input.
     Provides calming or motivating exercises depending on the emotion.
     """
-    if any(word in user_input for word in NEGATIVE_KEYWORDS):
+    matched = keyword_matcher.classify(user_input)
+    if matched["negative"]:
         speak("It sounds like you’re feeling a bit down. Let’s do something calming together.")
         if age <= 12:
             speak("Imagine you’re in a cozy fort filled with your favorite things. What would you have in there?")
@@ -1071,7 +3752,7 @@ def emotion_adaptive_scenario(user_input, age):
             speak("Think about a peaceful place that makes you feel calm. Where would it be?")
         else:
             speak("Take a deep breath and picture a moment when you felt truly at peace. What made it so calming?")
-    elif any(word in user_input for word in POSITIVE_KEYWORDS):
+    elif matched["positive"]:
         speak("You’re feeling good today! Let’s build on that positivity.")
         if age <= 12:
             speak("What’s something fun you want to do later?")
@@ -1236,8 +3917,10 @@ def session_wrap_up(conversation_log, name, age):
     """
     Provides a closing summary of the session and ensures the user feels heard and supported.
     """
+    if DEBUG_LOG_ENABLED:
+        log_debugging_data(conversation_log, "session_end")
     speak("Before we finish, let’s reflect on what we talked about today.")
-    for entry in conversation_log:
+    for entry in conversation_log.dialogue:
         if entry["role"] == "user":
             speak(f"You shared: {entry['content']}")
         elif entry["role"] == "assistant":
@@ -1252,12 +3935,12 @@ def session_wrap_up(conversation_log, name, age):
     speak("Thank you for spending time with me. I hope to talk to you again soon!")
 
 # Main function for integrating all features
-def main():
+def memory_session_loop():
     """
     Executes the chatbot session, integrating SEL exercises, emotion-based branching,
     memory, and dynamic user interaction.
     """
-    conversation_log = []
+    conversation_log = Session()
     name, age = load_memory_with_fallback()
     goals = []
 
@@ -1282,7 +3965,7 @@ def main():
     while True:
         user_input = listen()
         if not user_input:
-            reengage_user(age)
+            reengage_user(age, conversation_log)
             continue
         if is_quit_command(user_input):
             session_wrap_up(conversation_log, name, age)
@@ -1291,20 +3974,63 @@ def main():
         if detect_user_fatigue(conversation_log):
             continue
 
-        if any(word in user_input for word in NEGATIVE_KEYWORDS):
+        matched = keyword_matcher.classify(user_input)
+        if matched["negative"]:
             emotion_adaptive_scenario(user_input, age)
-        elif any(word in user_input for word in POSITIVE_KEYWORDS):
+        elif matched["positive"]:
             future_planning_exercise(name, age)
         else:
-            response = generate_response(user_input, conversation_log)
+            response = speak_stream(generate_response_stream(user_input, conversation_log))
             update_conversation_memory(conversation_log, user_input, response)
-            speak(response)
+
+# Adaptive listening timeout settings
+LISTEN_ONSET_WINDOW = 20  # Recent response onsets kept per user
+LISTEN_ONSET_PERCENTILE = 0.9  # Onset most of the user's answers start within
+LISTEN_MIN_ONSETS = 5  # Answers needed before the timeout adapts
+LISTEN_TIMEOUT_MARGIN = 1.5  # Multiplier applied to the percentile onset
+LISTEN_TIMEOUT_PADDING = 1.0  # Seconds added on top
+LISTEN_TIMEOUT_MIN = 4  # Never wait less than this
+LISTEN_TIMEOUT_MAX = 20  # Never wait more than this
+
+# Remember how long a user took to start answering
+def record_response_onset(name, seconds):
+    """
+    Appends an onset to the user's profile, keeping the most recent
+    LISTEN_ONSET_WINDOW. Timeouts are recorded at the timeout, so users who
+    run out of time get longer waits afterwards.
+    """
+    def change(record):
+        onsets = record.setdefault("listening", {}).setdefault("onsets", [])
+        onsets.append(round(seconds, 3))
+        del onsets[:-LISTEN_ONSET_WINDOW]
+
+    user_store.update(user_id_for(name), change)
+
+# Listening timeout learned from a user's own response times
+def adaptive_listening_timeout(name):
+    """
+    Returns a timeout derived from the user's recent response onsets, or
+    None until enough answers have been seen.
+    """
+    record = user_store.get(user_id_for(name)) or {}
+    onsets = sorted(record.get("listening", {}).get("onsets", []))
+    if len(onsets) < LISTEN_MIN_ONSETS:
+        return None
+    onset = onsets[min(len(onsets) - 1, int(len(onsets) * LISTEN_ONSET_PERCENTILE))]
+    timeout = onset * LISTEN_TIMEOUT_MARGIN + LISTEN_TIMEOUT_PADDING
+    return round(max(LISTEN_TIMEOUT_MIN, min(LISTEN_TIMEOUT_MAX, timeout)), 1)
+
 # Function to dynamically adjust listening time based on age
-def get_listening_timeout(age):
+def get_listening_timeout(age, name=None):
     """
     Determines the listening timeout based on the user's age group.
     Younger users are given more time to respond.
+    Once a named user has answered a few times, their own response times decide instead.
     """
+    if name:
+        adaptive_timeout = adaptive_listening_timeout(name)
+        if adaptive_timeout is not None:
+            return adaptive_timeout
     if age is None:
         # Default timeout before age is determined
         return 10
@@ -1316,25 +4042,36 @@ def get_listening_timeout(age):
         return 10  # Adults can handle shorter timeouts
 
 # Updated listen function with dynamic timeout
-def listen_with_dynamic_timeout(age):
+def listen_with_dynamic_timeout(age, name=None):
     """
     Listens to the user's input using a microphone with a timeout
-    that dynamically adjusts based on the user's age group.
-    """
-    timeout = get_listening_timeout(age)
+    that dynamically adjusts based on the user's age group, or on how
+    quickly this user usually starts answering.
+    """
+    if console_io is not None:
+        return console_io.read()
+    timeout = get_listening_timeout(age, name)
+    # A short wait for the answer to start shouldn't cut long answers short
+    phrase_time_limit = max(timeout, get_listening_timeout(age))
     print(f"Listening with a timeout of {timeout} seconds...")
-    with sr.Microphone() as source:
+    with microphone_capture.open_source() as source:
+        wait_for_turn(source)
+        source.catch_up()
+        timings = {}
         try:
-            audio = recognizer.listen(source, timeout=timeout, phrase_time_limit=timeout)
-            user_input = recognizer.recognize_google(audio)
+            user_input = recognize_phrase(source, timeout=timeout, phrase_time_limit=phrase_time_limit, timings=timings)
             print(f"User: {user_input}")
             return user_input.lower()
         except sr.UnknownValueError:
             speak("I didn’t catch that. Could you say it again?")
             return ""
         except sr.WaitTimeoutError:
+            timings["onset"] = timeout
             speak("I didn’t hear anything. Let’s try again.")
             return ""
+        finally:
+            if name and "onset" in timings:
+                record_response_onset(name, timings["onset"])
 
 # Function to interact and handle dynamic timeout based on age
 def interact_with_dynamic_listening(conversation_log, name, age):
@@ -1342,7 +4079,7 @@ def interact_with_dynamic_listening(conversation_log, name, age):
     Main interaction loop that adjusts listening time dynamically based on age.
     """
     while True:
-        user_input = listen_with_dynamic_timeout(age)
+        user_input = listen_with_dynamic_timeout(age, name)
         if not user_input:
             # Handle cases of no input
             speak("It’s okay, take your time. Let me know when you’re ready.")
@@ -1354,22 +4091,22 @@ def interact_with_dynamic_listening(conversation_log, name, age):
             break
 
         # Handle user responses and generate appropriate reactions
-        if any(word in user_input for word in NEGATIVE_KEYWORDS):
+        matched = keyword_matcher.classify(user_input)
+        if matched["negative"]:
             emotion_adaptive_scenario(user_input, age)
-        elif any(word in user_input for word in POSITIVE_KEYWORDS):
+        elif matched["positive"]:
             future_planning_exercise(name, age)
         else:
-            response = generate_response(user_input, conversation_log)
+            response = speak_stream(generate_response_stream(user_input, conversation_log))
             update_conversation_memory(conversation_log, user_input, response)
-            speak(response)
 
 # Main function updated to include dynamic listening timeout
-def main():
+def dynamic_listening_loop():
     """
     Executes the chatbot session, now with dynamic listening timeouts
     based on age groups.
     """
-    conversation_log = []
+    conversation_log = Session()
     name, age = load_memory_with_fallback()
 
     if not name or not age:
@@ -1400,14 +4137,6 @@ def explain_dynamic_listening():
     speak("Just so you know, I’ll give you extra time to respond based on your age.")
     speak("Younger users get more time to think and reply. Let me know if you’re ready!")
 
-# Entry point for the program
-if __name__ == "__main__":
-    explain_dynamic_listening()  # Ensure the dynamic listening explanation is executed
-    try:
-        main()  # Start the chatbot
-    except Exception as e:
-        handle_error(e)
-
 # Function to collect feedback from the user
 def collect_feedback(conversation_log, response):
     """
@@ -1441,24 +4170,7 @@ def analyze_feedback(conversation_log):
     Analyzes the feedback collected during the session.
     Calculates the average rating and highlights key comments.
     """
-    feedback_entries = [
-        entry["content"]
-        for entry in conversation_log
-        if entry["role"] == "feedback"
-    ]
-    if not feedback_entries:
-        return None
-
-    total_rating = sum(fb["rating"] for fb in feedback_entries)
-    avg_rating = total_rating / len(feedback_entries)
-
-    comments = [fb["comment"] for fb in feedback_entries if fb["comment"]]
-
-    return {
-        "average_rating": avg_rating,
-        "comments": comments,
-        "total_feedback": len(feedback_entries),
-    }
+    return conversation_log.feedback_summary()
 
 # Function to wrap up the session with feedback analysis
 def session_feedback_summary(conversation_log):
@@ -1482,7 +4194,7 @@ def interact_with_feedback(conversation_log, name, age):
     Main interaction loop that includes feedback collection.
     """
     while True:
-        user_input = listen_with_dynamic_timeout(age)
+        user_input = listen_with_dynamic_timeout(age, name)
         if not user_input:
             speak("It’s okay, take your time. Let me know when you’re ready.")
             continue
@@ -1491,14 +4203,14 @@ def interact_with_feedback(conversation_log, name, age):
             session_feedback_summary(conversation_log)
             break
 
-        if any(word in user_input for word in NEGATIVE_KEYWORDS):
+        matched = keyword_matcher.classify(user_input)
+        if matched["negative"]:
             emotion_adaptive_scenario(user_input, age)
-        elif any(word in user_input for word in POSITIVE_KEYWORDS):
+        elif matched["positive"]:
             future_planning_exercise(name, age)
         else:
-            response = generate_response(user_input, conversation_log)
+            response = speak_stream(generate_response_stream(user_input, conversation_log))
             update_conversation_memory(conversation_log, user_input, response)
-            speak(response)
 
             # Collect feedback for the generated response
             collect_feedback(conversation_log, response)
@@ -1590,11 +4302,11 @@ SEL_CATEGORIES = {
     ]
 }
 
-def get_random_prompt(category):
+def get_random_prompt(category, conversation_log=None):
     """
     Selects a random SEL prompt from a specified category.
     """
-    return random.choice(SEL_CATEGORIES.get(category, []))
+    return draw_sel_prompt(ANY_AGE, category, conversation_log)
 
 def advanced_sel_exercise(conversation_log, age):
     """
@@ -1603,7 +4315,7 @@ def advanced_sel_exercise(conversation_log, age):
     # Determine the appropriate SEL category
     categories = list(SEL_CATEGORIES.keys())
     chosen_category = random.choice(categories)
-    prompt = get_random_prompt(chosen_category)
+    prompt = get_random_prompt(chosen_category, conversation_log)
 
     # Speak the prompt and capture the response
     speak(f"Let’s try a {chosen_category.replace('-', ' ')} activity. {prompt}")
@@ -1622,39 +4334,29 @@ def interaction_with_advanced_sel(conversation_log, name, age):
     Enhanced interaction loop that includes advanced SEL exercises.
     """
     while True:
-        user_input = listen_with_dynamic_timeout(age)
+        user_input = listen_with_dynamic_timeout(age, name)
         if not user_input:
-            reengage_user(age)
+            reengage_user(age, conversation_log)
             continue
         if is_quit_command(user_input):
             session_wrap_up(conversation_log, name, age)
             break
 
-        if any(word in user_input for word in NEGATIVE_KEYWORDS):
+        matched = keyword_matcher.classify(user_input)
+        if matched["negative"]:
             emotion_adaptive_scenario(user_input, age)
-        elif any(word in user_input for word in POSITIVE_KEYWORDS):
+        elif matched["positive"]:
             advanced_sel_exercise(conversation_log, age)
         else:
-            response = generate_response(user_input, conversation_log)
+            response = speak_stream(generate_response_stream(user_input, conversation_log))
             update_conversation_memory(conversation_log, user_input, response)
-            speak(response)
 
 # Function to provide tailored SEL prompts
 def sel_prompt_by_category(age, category):
     """
     Provides an SEL prompt based on the user's age group and selected category.
     """
-    if age <= 12:
-        group = "child"
-    elif age <= 18:
-        group = "teen"
-    else:
-        group = "adult"
-
-    prompts = EXPANDED_SEL_PROMPTS.get(group, {}).get(category, [])
-    if prompts:
-        return random.choice(prompts)
-    return None
+    return draw_sel_prompt(SELPromptCatalog.age_band(age), category)
 
 # Function to facilitate SEL exercise
 def facilitate_sel_exercise(age, category):
@@ -1739,21 +4441,21 @@ def interact_with_dynamic_sel(conversation_log, name, age):
     Main interaction loop with SEL enhancements.
     """
     while True:
-        user_input = listen_with_dynamic_timeout(age)
+        user_input = listen_with_dynamic_timeout(age, name)
         if not user_input:
-            reengage_user(age)
+            reengage_user(age, conversation_log)
             continue
         if is_quit_command(user_input):
             session_wrap_up(conversation_log, name, age)
             break
-        if any(word in user_input for word in NEGATIVE_KEYWORDS):
+        matched = keyword_matcher.classify(user_input)
+        if matched["negative"]:
             emotion_adaptive_scenario(user_input, age)
-        elif any(word in user_input for word in POSITIVE_KEYWORDS):
+        elif matched["positive"]:
             dynamic_sel_activity(age)
         else:
-            response = generate_response(user_input, conversation_log)
+            response = speak_stream(generate_response_stream(user_input, conversation_log))
             update_conversation_memory(conversation_log, user_input, response)
-            speak(response)
 
 # Additional SEL Categories and Exercises
 ADDITIONAL_SEL_PROMPTS = {
@@ -1774,12 +4476,175 @@ ADDITIONAL_SEL_PROMPTS = {
     ]
 }
 
+# Unified SEL prompt catalog
+# ------------------------------------------------------
+
+ANY_AGE = "any"  # Band for prompts that suit every age group
+SEL_PROMPT_BANK = os.getenv("AMIE_PROMPT_BANK")  # Optional extra prompts (JSON)
+SEL_PROMPT_BANK_CACHE_FORMAT = 1  # Version of the compiled bank files written next to JSON banks
+
+# Every SEL prompt, indexed by (age band, category)
+class SELPromptCatalog:
+    """
+    Merges the SEL prompt tables above into one index keyed by
+    (age band, category), built once at startup. Prompts from tables that
+    share a key are combined without duplicates. The index can be saved as
+    flat JSON so large external prompt banks load without being rebuilt.
+    """
+    AGE_BANDS = ("child", "teen", "adult")
+
+    def __init__(self, prompts=None):
+        self.prompts = prompts or {}
+
+    @staticmethod
+    def age_band(age):
+        """
+        Maps an age to the band the prompt tables use; unknown ages get adult prompts.
+        """
+        if age is None:
+            return "adult"
+        if age <= 12:
+            return "child"
+        elif age <= 18:
+            return "teen"
+        return "adult"
+
+    def add(self, band, category, prompts):
+        existing = self.prompts.get((band, category), ())
+        self.prompts[(band, category)] = tuple(dict.fromkeys(existing + tuple(prompts)))
+
+    def add_table(self, table, band=None, category=None):
+        """
+        Adds a table keyed by category ({category: [...]}), by age band
+        ({band: [...]}, filed under category) or by both ({band: {category: [...]}}).
+        """
+        for key, value in table.items():
+            if isinstance(value, dict):
+                self.add_table(value, band=key)
+            elif band is None and category is not None:
+                self.add(key, category, value)
+            else:
+                self.add(band or ANY_AGE, key, value)
+
+    def get(self, band, category):
+        return self.prompts.get((band, category), ())
+
+    def categories(self, band=ANY_AGE):
+        return [category for prompt_band, category in self.prompts if prompt_band == band]
+
+    def all_prompts(self):
+        return {prompt for prompts in self.prompts.values() for prompt in prompts}
+
+    def save(self, path):
+        """
+        Writes the index as [band, category, prompts] rows, which load back without any merging.
+        """
+        rows = [[band, category, list(prompts)] for (band, category), prompts in self.prompts.items()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"format": SEL_PROMPT_BANK_CACHE_FORMAT, "prompts": rows}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a file written by save(). Raises ValueError for anything else.
+        """
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get("format") != SEL_PROMPT_BANK_CACHE_FORMAT:
+            raise ValueError(f"{path} is not a compiled prompt bank")
+        prompts = {}
+        for band, category, rows in data["prompts"]:
+            if not all(isinstance(prompt, str) for prompt in rows):
+                raise ValueError(f"{path} contains a non-text prompt")
+            prompts[(str(band), str(category))] = tuple(rows)
+        return cls(prompts)
+
+    def merge_bank(self, path):
+        """
+        Adds an external prompt bank. JSON banks use the same shapes as
+        add_table and are compiled to path + ".compiled" on first load, which
+        later starts read instead while it is newer than the JSON file.
+        Banks are only ever parsed as JSON, never unpickled.
+        """
+        compiled = path + ".compiled"
+        bank = None
+        if os.path.exists(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(path):
+            try:
+                bank = self.load(compiled)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Ignoring compiled prompt bank: {e}")
+        if bank is None:
+            with open(path, encoding="utf-8") as f:
+                bank = SELPromptCatalog()
+                bank.add_table(json.load(f))
+            bank.save(compiled)
+        for (band, category), prompts in bank.prompts.items():
+            self.add(band, category, prompts)
+
+# Non-repeating prompt draws
+class PromptSampler:
+    """
+    Draws prompts from a catalog using one shuffle bag per (band, category):
+    each bag is shuffled once and then walked, so a prompt is not repeated
+    until every other prompt in its bag has been used, and each draw is O(1)
+    amortized. With refill=False an empty bag returns None instead of reshuffling.
+    """
+    def __init__(self, catalog, rng=random):
+        self.catalog = catalog
+        self.rng = rng
+        self.bags = {}  # (band, category) -> [shuffled prompts, next position]
+
+    def draw(self, band, category, refill=True, exclude=()):
+        key = (band, category)
+        bag = self.bags.get(key)
+        while True:
+            if bag is None or bag[1] >= len(bag[0]):
+                if bag is not None and not refill:
+                    return None
+                prompts = [prompt for prompt in self.catalog.get(band, category) if prompt not in exclude]
+                if not prompts:
+                    return None
+                self.rng.shuffle(prompts)
+                # Don't repeat the last prompt of the previous round straight away
+                if bag is not None and len(prompts) > 1 and prompts[0] == bag[0][-1]:
+                    prompts[0], prompts[-1] = prompts[-1], prompts[0]
+                bag = self.bags[key] = [prompts, 0]
+            prompt = bag[0][bag[1]]
+            bag[1] += 1
+            if prompt not in exclude:
+                return prompt
+
+# Build the catalog from every prompt table in this file
+def build_sel_catalog(bank_path=SEL_PROMPT_BANK):
+    catalog = SELPromptCatalog()
+    catalog.add_table(SEL_PROMPTS, category="general")
+    for table in (EXPANDED_SEL_PROMPTS, SEL_REFLECTION_PROMPTS, EXPANDED_SEL_CATEGORIES,
+                  SEL_CATEGORIES, ADDITIONAL_SEL_PROMPTS):
+        catalog.add_table(table)
+    if bank_path:
+        catalog.merge_bank(bank_path)
+    return catalog
+
+sel_catalog = build_sel_catalog()
+
+# Sampler for prompts drawn outside a Session (one conversation per process in voice mode)
+default_prompt_sampler = PromptSampler(sel_catalog)
+
+# Draw the next SEL prompt for a band and category without repeats
+def draw_sel_prompt(band, category="general", conversation_log=None):
+    """
+    Returns the next prompt from the session's shuffle bag (or the process-wide
+    one), or None if the catalog has no prompts for that band and category.
+    """
+    sampler = conversation_log.sampler() if conversation_log is not None else default_prompt_sampler
+    return sampler.draw(band, category)
+
 # Function to provide a random SEL prompt from additional categories
-def get_additional_prompt(category):
+def get_additional_prompt(category, conversation_log=None):
     """
     Selects a random SEL prompt from the additional categories.
     """
-    return random.choice(ADDITIONAL_SEL_PROMPTS.get(category, []))
+    return draw_sel_prompt(ANY_AGE, category, conversation_log)
 
 # Function for advanced SEL branching scenarios
 def advanced_branching_scenario(conversation_log, age):
@@ -1790,7 +4655,7 @@ def advanced_branching_scenario(conversation_log, age):
     # Select a random category for the scenario
     categories = list(ADDITIONAL_SEL_PROMPTS.keys())
     chosen_category = random.choice(categories)
-    prompt = get_additional_prompt(chosen_category)
+    prompt = get_additional_prompt(chosen_category, conversation_log)
 
     speak(f"Here’s a {chosen_category.replace('-', ' ')} activity: {prompt}")
     user_response = listen()
@@ -1851,9 +4716,9 @@ def interaction_with_expanded_sel(conversation_log, name, age):
     Interaction loop with expanded SEL exercises and feedback handling.
     """
     while True:
-        user_input = listen_with_dynamic_timeout(age)
+        user_input = listen_with_dynamic_timeout(age, name)
         if not user_input:
-            reengage_user(age)
+            reengage_user(age, conversation_log)
             continue
 
         if is_quit_command(user_input):
@@ -1861,15 +4726,15 @@ def interaction_with_expanded_sel(conversation_log, name, age):
             break
 
         # Handle negative or positive emotion keywords
-        if any(word in user_input for word in NEGATIVE_KEYWORDS):
+        matched = keyword_matcher.classify(user_input)
+        if matched["negative"]:
             emotion_adaptive_scenario(user_input, age)
-        elif any(word in user_input for word in POSITIVE_KEYWORDS):
+        elif matched["positive"]:
             advanced_branching_scenario(conversation_log, age)
         else:
             # Generate a dynamic response and append feedback
-            response = generate_response(user_input, conversation_log)
+            response = speak_stream(generate_response_stream(user_input, conversation_log))
             update_conversation_memory(conversation_log, user_input, response)
-            speak(response)
 
             # Add feedback after responses
             feedback_score = collect_feedback(conversation_log, response)
@@ -1884,22 +4749,818 @@ def chat():
     """
     Handle chat messages via API.
     """
-    user_input = request.json.get('message')  # Correct usage of Bottle's request object
+    body = request.json or {}
+    user_input = body.get('message')  # Correct usage of Bottle's request object
     if not user_input:
         response.status = 400  # Set HTTP status to 400 for bad requests
         return {"error": "No message provided"}
+    try:
+        parse_session_fields(body)
+    except ValueError as e:
+        response.status = 400
+        return {"error": str(e)}
 
     try:
-        # Replace with your chatbot logic
-        bot_response = generate_response(user_input)  # Correctly calls your chatbot's response function
-        return {"response": bot_response}  # JSON response structure
+        return chat_turn(body)  # JSON response structure
     except Exception as e:
         response.status = 500  # Set HTTP status to 500 for server errors
         return {"error": str(e)}  # Return error details for debugging
 
+# One /chat turn: session lookup, response generation and logging
+def chat_turn(body):
+    """
+    Answers one /chat request body and returns the JSON response.
+    """
+    user_input = body['message']
+    # Session-specific turns can opt out of the shared response cache
+    cacheable = body.get('cache', True) is not False
+    start = time.perf_counter()
+    session = session_registry.get(body.get('session_id'))
+    with session.lock:
+        apply_session_fields(session, body)
+        bot_response = generate_response(user_input, session, cacheable=cacheable)  # Correctly calls your chatbot's response function
+        session.append({"role": "user", "content": user_input})
+        session.append({"role": "assistant", "content": bot_response})
+    session_registry.touch(session)
+    conversation_sink.emit({
+        "ts": time.time(),
+        "type": "api_turn",
+        "session_id": session.session_id,
+        "user": user_input,
+        "response": bot_response,
+        "latency_ms": 1000 * (time.perf_counter() - start),
+    })
+    return {"response": bot_response, "session_id": session.session_id}
+
+# Batch endpoint settings
+BATCH_MAX_ITEMS = 1000  # Messages accepted in one /chat/batch request
+BATCH_DEFAULT_CONCURRENCY = 8  # Messages processed at once unless the request asks otherwise
+BATCH_MAX_CONCURRENCY = BOTLIBRE_POOL_SIZE  # Upper bound, so every worker gets a pooled Bot Libre connection
+
+# Answer a list of /chat bodies concurrently
+def process_chat_batch(items, concurrency=BATCH_DEFAULT_CONCURRENCY, turn=chat_turn):
+    """
+    Runs each item through the /chat pipeline on a thread pool and returns
+    results in input order, each with its latency and any error. Items that
+    share a session_id run one after another, in order, so the conversation
+    builds up the same way it would over sequential /chat calls.
+    """
+    results = [None] * len(items)
+    groups = OrderedDict()
+    for index, item in enumerate(items):
+        session_id = item.get('session_id') if isinstance(item, dict) else None
+        groups.setdefault(session_id if session_id else ("item", index), []).append(index)
+
+    def run_group(indexes):
+        for index in indexes:
+            item = items[index]
+            start = time.perf_counter()
+            if not isinstance(item, dict) or not item.get('message'):
+                result = {"error": "No message provided"}
+            else:
+                try:
+                    result = turn(item)
+                except Exception as e:
+                    result = {"error": str(e)}
+            result["latency_ms"] = 1000 * (time.perf_counter() - start)
+            results[index] = result
+
+    workers = max(1, min(concurrency, len(groups)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="amie-batch") as executor:
+        for future in [executor.submit(run_group, indexes) for indexes in groups.values()]:
+            future.result()
+    return results
+
+@app.post('/chat/batch')
+def chat_batch():
+    """
+    Handle many chat messages in one request. The body is
+    {"messages": [<chat body>, ...], "concurrency": n}; each message takes the
+    same fields as /chat. Results come back in the same order.
+    """
+    body = request.json or {}
+    items = body.get('messages')
+    if not isinstance(items, list) or not items:
+        response.status = 400
+        return {"error": "No messages provided"}
+    if len(items) > BATCH_MAX_ITEMS:
+        response.status = 413
+        return {"error": f"At most {BATCH_MAX_ITEMS} messages per batch"}
+    try:
+        concurrency = int(body.get('concurrency', BATCH_DEFAULT_CONCURRENCY))
+    except (TypeError, ValueError):
+        response.status = 400
+        return {"error": "concurrency must be an integer"}
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    start = time.perf_counter()
+    results = process_chat_batch(items, concurrency)
+    return {
+        "results": results,
+        "errors": sum(1 for result in results if "error" in result),
+        "latency_ms": 1000 * (time.perf_counter() - start),
+    }
+
+# Server-Sent Events framing for /chat/stream
+def format_sse(data, event=None):
+    """
+    Encodes one Server-Sent Event with a JSON payload.
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/chat/stream', method=['GET', 'POST'])
+def chat_stream():
+    """
+    Stream a chat response token by token as Server-Sent Events.
+    Accepts the same JSON body as /chat, or ?message= for EventSource clients.
+    """
+    if request.method == 'POST':
+        body = request.json or {}
+        cacheable = body.get('cache', True) is not False
+    else:
+        body = dict(request.query)
+        cacheable = request.query.get('cache') != 'false'
+    user_input = body.get('message')
+    if not user_input:
+        response.status = 400
+        return {"error": "No message provided"}
+    try:
+        parse_session_fields(body)
+    except ValueError as e:
+        response.status = 400
+        return {"error": str(e)}
+
+    session = session_registry.get(body.get('session_id'))
+    with session.lock:
+        apply_session_fields(session, body)
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+
+    def events():
+        timings = {}
+        tokens = []
+        try:
+            # Held while streaming; released if the client goes away and the generator is closed
+            with session.lock:
+                for token in generate_response_stream(user_input, session, cacheable=cacheable, timings=timings):
+                    tokens.append(token)
+                    yield format_sse({"token": token})
+                session.append({"role": "user", "content": user_input})
+                session.append({"role": "assistant", "content": "".join(tokens)})
+            session_registry.touch(session)
+            timings["session_id"] = session.session_id
+            yield format_sse(timings, event="done")
+        except Exception as e:
+            yield format_sse({"error": str(e)}, event="error")
+
+    return events()
+
+@app.delete('/session/<session_id>')
+def end_session(session_id):
+    """
+    End an API session and release its conversation state.
+    """
+    session = session_registry.end(session_id)
+    if session is None:
+        response.status = 404
+        return {"error": "Unknown session"}
+    return {"session_id": session_id, "turns": len(session.dialogue), "feedback": session.feedback_summary()}
+
+@app.get('/stats')
+def stats():
+    """
+    Report runtime counters, such as how much traffic the local AIML engine absorbs.
+    """
+    return {
+        "aiml": aiml_engine.stats(),
+        "botlibre": botlibre_client.stats(),
+        "response_cache": response_cache.stats(),
+        "streaming": stream_metrics.stats(),
+        "context": context_metrics.stats(),
+        "conversation_log": conversation_sink.stats(),
+        "user_store": user_store.stats(),
+        "sessions": session_registry.stats(),
+        "startup": startup_stats(),
+        "microphone": microphone_capture.stats(),
+        "asr": asr_backend.stats() if asr_backend.initialized else None,
+    }
+
+# Asynchronous serving mode
+# ------------------------------------------------------
+
+# Non-blocking Bot Libre client for the asyncio server
+class AsyncBotLibreClient(BotLibreClient):
+    """
+    asyncio variant of BotLibreClient built on aiohttp.
+    Shares the timeout, retry and latency accounting behaviour of the
+    blocking client, but lets one process keep many calls in flight.
+    """
+    def _create_session(self):
+        # aiohttp sessions must be created inside the running event loop
+        return None
+
+    def _ensure_session(self):
+        """
+        Opens the pooled aiohttp session on first use.
+        """
+        if self.session is None or self.session.closed:
+            connect_timeout, read_timeout = self.timeout
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout),
+            )
+        return self.session
+
+    async def send_message(self, message):
+        """
+        Sends a message to Bot Libre without blocking the event loop.
+        """
+        session = self._ensure_session()
+        payload = {
+            'application': self.application,
+            'instance': self.instance,
+            'message': message
+        }
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                async with session.post(self.url, json=payload) as response:
+                    if response.status == 200:
+                        data = await response.json(content_type=None)
+                        self._record(time.perf_counter() - start, attempt, False)
+                        return data.get('message')
+                    if response.status not in self.RETRY_STATUS_CODES or attempt >= self.max_retries:
+                        self._record(time.perf_counter() - start, attempt, True)
+                        return f"Error: Unable to communicate with Bot Libre (Status Code: {response.status})"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    self._record(time.perf_counter() - start, attempt, True)
+                    return f"Error: {str(e) or type(e).__name__}"
+            await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+            attempt += 1
+
+    async def close(self):
+        """
+        Closes the pooled connections.
+        """
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+# Refine a Bot Libre reply with OpenAI without blocking the event loop
+async def refine_with_openai_async(botlibre_response):
+    """
+    Async counterpart of the OpenAI refinement step in generate_response.
+    """
+    require_openai_key()
+    openai_response = await openai.Completion.acreate(
+        model=COMPLETION_MODEL,
+        prompt=botlibre_response,
+        max_tokens=150,
+        temperature=0.7
+    )
+    return openai_response.choices[0].text.strip()
+
+# Async version of generate_response
+async def generate_response_async(user_input, botlibre, refine=refine_with_openai_async, cacheable=True,
+                                  conversation_log=None):
+    """
+    Generates a response with the same AIML -> cache -> Bot Libre -> OpenAI
+    pipeline as generate_response, awaiting each upstream instead of blocking.
+    """
+    aiml_response = aiml_engine.respond(user_input)
+    if aiml_response:
+        return aiml_response
+    # Answers that depend on earlier turns are session-specific
+    if conversation_log:
+        cacheable = False
+    if cacheable:
+        cached_response = response_cache.get(user_input)
+        if cached_response is not None:
+            return cached_response
+    botlibre_response = await botlibre.send_message(user_input)
+    refined_response = await refine(botlibre_response)
+    if cacheable and refined_response and not botlibre_response.startswith("Error:"):
+        response_cache.put(user_input, refined_response)
+    return refined_response
+
+# Build the asyncio /chat application
+def create_async_app(botlibre=None, refine=refine_with_openai_async):
+    """
+    Creates an aiohttp application serving the same /chat and /stats contract
+    as the Bottle app, including session_id and the session fields.
+    Upstreams can be swapped out, e.g. for load testing.
+    """
+    if web is None:
+        raise RuntimeError("Async server mode requires the aiohttp package.")
+    botlibre = botlibre or AsyncBotLibreClient(pool_size=ASYNC_UPSTREAM_CONNECTIONS)
+
+    async def chat_async(http_request):
+        try:
+            body = await http_request.json()
+        except ValueError:
+            body = None
+        user_input = body.get('message') if isinstance(body, dict) else None
+        if not user_input:
+            return web.json_response({"error": "No message provided"}, status=400)
+        try:
+            parse_session_fields(body)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        try:
+            cacheable = body.get('cache', True) is not False
+            start = time.perf_counter()
+            session = session_registry.get(body.get('session_id'))
+            if session.async_lock is None:
+                session.async_lock = asyncio.Lock()
+            async with session.async_lock:
+                apply_session_fields(session, body)
+                bot_response = await generate_response_async(user_input, botlibre, refine, cacheable, session)
+                session.append({"role": "user", "content": user_input})
+                session.append({"role": "assistant", "content": bot_response})
+            session_registry.touch(session)
+            conversation_sink.emit({
+                "ts": time.time(),
+                "type": "api_turn",
+                "session_id": session.session_id,
+                "user": user_input,
+                "response": bot_response,
+                "latency_ms": 1000 * (time.perf_counter() - start),
+            })
+            return web.json_response({"response": bot_response, "session_id": session.session_id})
+        except Exception as e:
+            return web.json_response({"error": str(e)}, status=500)
+
+    async def stats_async(http_request):
+        return web.json_response({
+            "aiml": aiml_engine.stats(),
+            "botlibre": botlibre.stats(),
+            "response_cache": response_cache.stats(),
+        })
+
+    async def close_upstreams(async_app):
+        if hasattr(botlibre, "close"):
+            await botlibre.close()
+
+    async_app = web.Application()
+    async_app.router.add_post('/chat', chat_async)
+    async_app.router.add_get('/stats', stats_async)
+    async_app.on_cleanup.append(close_upstreams)
+    return async_app
+
+# Start the asyncio server
+def run_async_server(host="localhost", port=5000):
+    """
+    Serves /chat from a single asyncio event loop so hundreds of conversations
+    can wait on Bot Libre and OpenAI concurrently.
+    """
+    web.run_app(create_async_app(), host=host, port=port)
+
+# Stand-in for Bot Libre used by the load test
+class StubBotLibre:
+    """
+    Simulates Bot Libre with a fixed reply and artificial latency.
+    """
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+
+    async def send_message(self, message):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return f"Bot Libre reply to: {message}"
+
+    def stats(self):
+        return {"calls": self.calls}
+
+# Load test for the asyncio server against stubbed upstreams
+async def async_load_test(total_requests=2000, concurrency=200, upstream_latency=0.05):
+    """
+    Starts the async /chat server with stubbed Bot Libre and OpenAI upstreams,
+    drives it with concurrent clients and reports requests/sec and latency percentiles.
+    Run with: asyncio.run(async_load_test())
+    """
+    async def stub_refine(botlibre_response):
+        await asyncio.sleep(upstream_latency)
+        return botlibre_response
+
+    runner = web.AppRunner(create_async_app(StubBotLibre(upstream_latency), stub_refine))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}/chat"
+
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request(session, index):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            # Messages that the AIML knowledge base does not cover, so both upstreams are exercised
+            async with session.post(url, json={"message": f"load test message {index}"}) as http_response:
+                await http_response.read()
+                if http_response.status != 200:
+                    failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+            start = time.perf_counter()
+            await asyncio.gather(*(one_request(session, i) for i in range(total_requests)))
+            elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+
+    latencies.sort()
+    results = {
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "upstream_latency_ms": 1000 * upstream_latency,
+        "failures": failures,
+        "requests_per_sec": total_requests / elapsed,
+        "p50_ms": 1000 * latencies[len(latencies) // 2],
+        "p99_ms": 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+    print(f"Async /chat load test: {results}")
+    return results
+
+# Startup regression benchmark settings
+STARTUP_BENCHMARK_FILE = "startup_benchmark.jsonl"
+STARTUP_REGRESSION_TOLERANCE = 1.25  # Flag medians more than 25% slower than the best recorded run
+
+# Measures import time and time to the first answered request in a fresh interpreter
+STARTUP_PROBE = """
+import io, json, sys, time
+start = time.perf_counter()
+import Empathy13 as amie
+imported = time.perf_counter()
+body = json.dumps({"message": sys.argv[1], "cache": False}).encode()
+status = []
+amie.app({
+    "REQUEST_METHOD": "POST", "PATH_INFO": "/chat", "QUERY_STRING": "",
+    "CONTENT_TYPE": "application/json", "CONTENT_LENGTH": str(len(body)),
+    "SERVER_NAME": "localhost", "SERVER_PORT": "5000", "wsgi.url_scheme": "http",
+    "wsgi.input": io.BytesIO(body), "wsgi.errors": sys.stderr,
+}, lambda status_line, headers, exc_info=None: status.append(status_line))
+answered = time.perf_counter()
+print(json.dumps({
+    "import_ms": 1000 * (imported - start),
+    "first_request_ms": 1000 * (answered - imported),
+    "status": status[0],
+    "audio_initialized": amie.engine.initialized or amie.recognizer.initialized,
+}))
+"""
+
+# Regression benchmark for import time and time-to-first-request
+def benchmark_startup(runs=5, message="hello", record_file=STARTUP_BENCHMARK_FILE,
+                      tolerance=STARTUP_REGRESSION_TOLERANCE):
+    """
+    Imports the module in fresh interpreters and sends one /chat request that
+    the AIML knowledge base answers, so no network or audio device is needed.
+    Medians are appended to record_file and compared with the best earlier run.
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [module_dir, os.getenv("PYTHONPATH")])))
+    samples = []
+    # Run from a scratch directory so the probe's logs and databases are thrown away
+    with tempfile.TemporaryDirectory() as scratch:
+        for _ in range(runs):
+            probe = subprocess.run([sys.executable, "-c", STARTUP_PROBE, message], cwd=scratch, env=env,
+                                   capture_output=True, text=True, check=True)
+            samples.append(json.loads(probe.stdout.strip().splitlines()[-1]))
+
+    def median(key):
+        values = sorted(sample[key] for sample in samples)
+        return values[len(values) // 2]
+
+    results = {
+        "ts": time.time(),
+        "runs": runs,
+        "import_ms": median("import_ms"),
+        "first_request_ms": median("first_request_ms"),
+        "status": samples[-1]["status"],
+        "audio_initialized": any(sample["audio_initialized"] for sample in samples),
+    }
+    history = list(read_jsonl_log(record_file))
+    results["regressions"] = [
+        key for key in ("import_ms", "first_request_ms")
+        if history and results[key] > tolerance * min(record[key] for record in history)
+    ]
+    with open(record_file, "a") as f:
+        f.write(json.dumps(results) + "\n")
+    print(f"Startup benchmark: {results}")
+    return results
+
+# Unattended replay sessions
+# ------------------------------------------------------
+
+REPLAY_SAMPLE_RATE = 16000  # Rate of the silence generated for unanswered turns
+REPLAY_LEADING_SILENCE = 0.5  # Seconds of silence before each recorded answer
+REPLAY_TRAILING_SILENCE = 1.5  # Seconds of silence after it, enough for the VAD to end the turn
+REPLAY_REPORT_FILE = "replay_sessions.jsonl"
+
+# TTS stand-in that records instead of speaking
+class NullTTSSink:
+    """
+    Replaces the TTS worker in unattended runs. Nothing is played; every
+    utterance is recorded with the time it was queued (seconds since the
+    sink was created) and its rate.
+    """
+    voice = None
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.utterances = []
+
+    def start(self):
+        pass
+
+    def submit(self, text, rate=SPEECH_RATE, render_path=None):
+        self.utterances.append({"t": time.perf_counter() - self.start_time, "text": text, "rate": rate})
+        spoken = Future()
+        spoken.set_result(True)
+        return spoken
+
+    def cancel_all(self):
+        pass
+
+    def is_busy(self):
+        return False
+
+    def wait_idle(self, timeout=None):
+        return True
+
+# Microphone stand-in that answers each listen call with the next WAV fixture
+class ReplayCapture:
+    """
+    Takes the place of microphone_capture: each listen call gets a source
+    that plays the next fixture framed by silence. A fixture is a WAV path,
+    a (path, speech_end_seconds) pair, or None for a turn where the user
+    says nothing; without an annotation the end of speech is found with
+    voice activity detection, as in measure_turn_gaps. The audio then goes through the
+    usual VAD endpointing and recognition backend. With realtime=True reads
+    are paced like a live microphone, otherwise they run at CPU speed.
+    When the fixtures run out the session is ended with SystemExit.
+    """
+    def __init__(self, fixtures, realtime=False, chunk_size=TURN_GAP_CHUNK, clock_start=None):
+        self.fixtures = list(fixtures)
+        self.realtime = realtime
+        self.chunk_size = chunk_size
+        self.start_time = clock_start if clock_start is not None else time.perf_counter()
+        self.turns = []
+
+    def open_source(self, preroll=None):
+        if len(self.turns) >= len(self.fixtures):
+            raise SystemExit(0)
+        return ReplaySource(self, self.fixtures[len(self.turns)])
+
+    def current_transcript(self):
+        """
+        Returns the transcript stored next to the fixture being played (name.txt), if any.
+        """
+        fixture = self.turns[-1]["path"] if self.turns else None
+        transcript_path = os.path.splitext(fixture)[0] + ".txt" if fixture else None
+        if transcript_path and os.path.exists(transcript_path):
+            with open(transcript_path, encoding="utf-8") as f:
+                return f.read().strip()
+        return ""
+
+    def stats(self):
+        return {"turns": len(self.turns), "fixtures": len(self.fixtures)}
+
+# speech_recognition audio source for one replayed turn
+class ReplaySource(sr.AudioSource):
+    def __init__(self, capture, fixture):
+        self.capture = capture
+        path, speech_end = fixture if isinstance(fixture, (tuple, list)) else (fixture, None)
+        if path is None:
+            self.SAMPLE_RATE, self.SAMPLE_WIDTH, recording_audio = REPLAY_SAMPLE_RATE, 2, b""
+            # Long enough for any listening timeout to run out
+            leading_seconds, trailing_seconds = LISTEN_TIMEOUT_MAX + 1, 0
+        else:
+            with sr.AudioFile(path) as recording:
+                self.SAMPLE_RATE, self.SAMPLE_WIDTH = recording.SAMPLE_RATE, recording.SAMPLE_WIDTH
+                recording_audio = b"".join(iter(lambda: recording.stream.read(self.capture.chunk_size), b""))
+            if speech_end is None:
+                # Judged with the threshold the session's own endpointing uses
+                vad = VoiceActivityDetector(self.SAMPLE_RATE, self.SAMPLE_WIDTH)
+                speech_end = reference_speech_end(
+                    vad.classify(recording_audio, recognizer.energy_threshold), vad.frame_seconds)
+            leading_seconds, trailing_seconds = REPLAY_LEADING_SILENCE, REPLAY_TRAILING_SILENCE
+        bytes_per_second = self.SAMPLE_RATE * self.SAMPLE_WIDTH
+        leading = b"\x00" * (int(leading_seconds * self.SAMPLE_RATE) * self.SAMPLE_WIDTH)
+        self.audio = leading + recording_audio + b"\x00" * (int(trailing_seconds * self.SAMPLE_RATE) * self.SAMPLE_WIDTH)
+        # Byte offset where the user stops talking; the recording may go on with room noise
+        self.speech_end = len(leading) + int(speech_end * self.SAMPLE_RATE) * self.SAMPLE_WIDTH if speech_end else None
+        self.seconds_per_byte = 1.0 / bytes_per_second
+        self.CHUNK = capture.chunk_size
+        self.stream = None
+        self.turn = {"path": path, "speech_end": speech_end, "speech_end_at": None}
+        capture.turns.append(self.turn)
+
+    class Stream:
+        def __init__(self, source):
+            self.source = source
+            self.offset = 0
+
+        def read(self, frames):
+            source = self.source
+            data = source.audio[self.offset:self.offset + frames * source.SAMPLE_WIDTH]
+            self.offset += len(data)
+            if source.capture.realtime and data:
+                time.sleep(len(data) * source.seconds_per_byte)
+            if source.speech_end is not None and source.turn["speech_end_at"] is None and self.offset >= source.speech_end:
+                source.turn["speech_end_at"] = time.perf_counter() - source.capture.start_time
+            return data
+
+    def __enter__(self):
+        self.stream = self.Stream(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stream = None
+
+    def catch_up(self):
+        pass
+
+# Recognition backend that returns the fixture's stored transcript
+class TranscriptRecognitionBackend(RecognitionBackend):
+    """
+    Deterministic recognizer for replay sessions: returns the text of the
+    name.txt file next to the WAV being played, so runs need no network or
+    model while capture and endpointing still process the audio.
+    """
+    name = "transcript"
+
+    def __init__(self, capture):
+        super().__init__()
+        self.capture = capture
+
+    def transcribe(self, audio):
+        text = self.capture.current_transcript()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+# Run one conversation loop unattended from recorded answers
+def run_replay_session(fixtures, loop="dynamic", realtime=False, use_transcripts=True, report_file=REPLAY_REPORT_FILE):
+    """
+    Plays fixtures as the user's answers with speech output recorded by a
+    NullTTSSink, then reports for each turn the time from the end of the
+    user's speech to Amie's next utterance. A fresh user store is used so
+    runs don't depend on earlier sessions. Results are appended to report_file.
+    """
+    global microphone_capture, tts_worker, asr_backend, user_store
+    saved = (microphone_capture, tts_worker, asr_backend, user_store)
+    sink = NullTTSSink()
+    capture = ReplayCapture(fixtures, realtime, clock_start=sink.start_time)
+    scratch = tempfile.TemporaryDirectory()
+    microphone_capture, tts_worker = capture, sink
+    user_store = UserStore(os.path.join(scratch.name, USER_STORE_FILE), legacy_file=None)
+    if use_transcripts:
+        asr_backend = TranscriptRecognitionBackend(capture)
+    recognition = asr_backend
+    try:
+        CONVERSATION_LOOPS[loop]()
+    except SystemExit:
+        pass
+    except Exception as e:
+        handle_error(e)
+    finally:
+        user_store.flush()
+        microphone_capture, tts_worker, asr_backend, user_store = saved
+        scratch.cleanup()
+
+    latencies = []
+    for turn in capture.turns:
+        if turn["speech_end_at"] is None:
+            continue
+        replies = [utterance["t"] for utterance in sink.utterances if utterance["t"] >= turn["speech_end_at"]]
+        turn["response_latency"] = replies[0] - turn["speech_end_at"] if replies else None
+        if replies:
+            latencies.append(turn["response_latency"])
+    latencies.sort()
+    report = {
+        "ts": time.time(),
+        "loop": loop,
+        "realtime": realtime,
+        "turns": len(capture.turns),
+        "utterances": len(sink.utterances),
+        "median_response_latency_ms": 1000 * latencies[len(latencies) // 2] if latencies else None,
+        "p95_response_latency_ms": 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        "recognition": recognition.stats() if use_transcripts or recognition.initialized else None,
+    }
+    if report_file:
+        with open(report_file, "a") as f:
+            f.write(json.dumps(report) + "\n")
+    print(f"Replay session: {report}")
+    report["transcript"] = sink.utterances
+    report["turn_details"] = capture.turns
+    return report
+
+# Run modes
+# ------------------------------------------------------
+
+# Conversation loops that voice and text modes can run
+def dynamic_listening_session():
+    explain_dynamic_listening()  # Ensure the dynamic listening explanation is executed
+    dynamic_listening_loop()
+
+CONVERSATION_LOOPS = {
+    "dynamic": dynamic_listening_session,
+    "memory": memory_session_loop,
+    "sel": sel_rotation_loop,
+    "basic": basic_conversation_loop,
+}
+
+# Run a conversation loop with the microphone and speaker
+def run_voice(loop="dynamic"):
+    try:
+        CONVERSATION_LOOPS[loop]()  # Start the chatbot
+    except Exception as e:
+        handle_error(e)
+    finally:
+        tts_worker.wait_idle(timeout=TTS_WAIT_TIMEOUT)
+
+# Run a conversation loop over stdin/stdout without audio
+def run_text(loop="dynamic", input_stream=None, output_stream=None):
+    """
+    Drives the same conversation loop as voice mode with typed turns, so the
+    conversation logic can be exercised (and load tested) at CPU speed.
+    """
+    global console_io
+    console_io = ConsoleIO(input_stream, output_stream)
+    start = time.perf_counter()
+    try:
+        CONVERSATION_LOOPS[loop]()
+    except SystemExit:
+        pass
+    except Exception as e:
+        handle_error(e)
+    finally:
+        turns, console_io = console_io.turns, None
+    return {"turns": turns, "seconds": time.perf_counter() - start}
+
+# Run every benchmark that works without audio or upstream services
+def run_benchmarks(recordings_dir=None):
+    results = {
+        "startup": benchmark_startup(),
+        "keyword_matching": benchmark_keyword_matching(),
+    }
+    if aiohttp is not None:
+        results["async_load_test"] = asyncio.run(async_load_test())
+    if recordings_dir:
+        recordings = sorted(
+            os.path.join(recordings_dir, name) for name in os.listdir(recordings_dir) if name.endswith(".wav")
+        )
+        results["turn_gaps"] = measure_turn_gaps(recordings)
+    return results
+
+# Single entry point
+def main(argv=None):
+    """
+    Starts Amie in one mode: voice (microphone and speaker), text (stdin/stdout),
+    replay (recorded answers, nothing played), server (Bottle), async-server
+    (aiohttp), benchmark or prebuild-audio (render the audio cache). Only voice
+    and prebuild-audio modes initialize text-to-speech.
+    """
+    parser = argparse.ArgumentParser(description="Amie, an SEL companion chatbot.")
+    parser.add_argument("mode", nargs="?", default="voice",
+                        choices=["voice", "text", "replay", "server", "async-server", "benchmark", "prebuild-audio"])
+    parser.add_argument("--loop", default="dynamic", choices=sorted(CONVERSATION_LOOPS),
+                        help="conversation loop used by voice, text and replay modes")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--recordings", help="directory of WAV answers: replayed in order in replay mode, "
+                                             "used to measure turn gaps in benchmark mode")
+    parser.add_argument("--realtime", action="store_true", help="pace replayed audio like a live microphone")
+    args = parser.parse_args(argv)
+
+    if args.mode == "voice":
+        run_voice(args.loop)
+    elif args.mode == "text":
+        run_text(args.loop)
+    elif args.mode == "replay":
+        if not args.recordings:
+            parser.error("replay mode needs --recordings")
+        fixtures = sorted(
+            os.path.join(args.recordings, name) for name in os.listdir(args.recordings) if name.endswith(".wav")
+        )
+        run_replay_session(fixtures, args.loop, realtime=args.realtime)
+    elif args.mode == "server":
+        run(app, host=args.host, port=args.port, debug=True)  # Debug mode enabled for detailed error messages
+    elif args.mode == "async-server":
+        run_async_server(host=args.host, port=args.port)
+    elif args.mode == "prebuild-audio":
+        prebuild_audio_cache()
+    else:
+        run_benchmarks(args.recordings)
+
 if __name__ == "__main__":
-    # Start the Bottle server
-    run(app, host="localhost", port=5000, debug=True)  # Debug mode enabled for detailed error messages
+    main()
 
 
 
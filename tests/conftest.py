@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Empathy13 as amie  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A scratch user store swapped in for the shared one."""
+    scratch = amie.UserStore(path=str(tmp_path / "users.db"), flush_interval=0, legacy_file=None)
+    monkeypatch.setattr(amie, "user_store", scratch)
+    return scratch
@@ -0,0 +1,78 @@
+import xml.etree.ElementTree as ET
+
+import Empathy13 as amie
+
+
+def template(xml):
+    return ET.fromstring("<template>" + xml + "</template>")
+
+
+def graphmaster(*categories):
+    graph = amie.AIMLGraphmaster()
+    for pattern, xml in categories:
+        graph.add_category(pattern, template(xml))
+    return graph
+
+
+def test_exact_pattern_matches_case_and_punctuation_insensitively():
+    graph = graphmaster(("HELLO AMIE", "Hi there!"))
+    assert graph.respond("hello, Amie!") == "Hi there!"
+    assert graph.respond("hello") is None
+    assert graph.stats()["hits"] == 1
+    assert graph.stats()["misses"] == 1
+
+
+def test_star_captures_the_users_spelling():
+    graph = graphmaster(("MY NAME IS *", "Nice to meet you, <star/>."))
+    assert graph.respond("my name is Mary Jane") == "Nice to meet you, Mary Jane."
+    assert graph.respond("my name is") is None
+
+
+def test_indexed_stars():
+    graph = graphmaster(("* LIKES *", "<star index=\"2\"/> is liked by <star/>"))
+    assert graph.respond("Sam likes green tea") == "green tea is liked by Sam"
+
+
+def test_exact_word_beats_star_and_underscore_beats_exact_word():
+    graph = graphmaster(("I FEEL *", "star"), ("I FEEL SAD", "exact"))
+    assert graph.respond("I feel sad") == "exact"
+    assert graph.respond("I feel tired") == "star"
+    graph.add_category("I _ SAD", template("underscore"))
+    assert graph.respond("I feel sad") == "underscore"
+
+
+def test_curly_apostrophes_match_straight_ones():
+    graph = graphmaster(("I'M SAD", "Sorry to hear that."))
+    assert graph.respond("I’m sad") == "Sorry to hear that."
+
+
+def test_keyword_matching_is_whole_word():
+    matcher = amie.KeywordMatcher({"negative": ["mad"], "positive": ["happy"]})
+    assert matcher.classify("I made a cake") == {"negative": [], "positive": []}
+    assert matcher.classify("I'm MAD but happy") == {"negative": ["mad"], "positive": ["happy"]}
+
+
+def test_inflected_sets_report_the_base_keyword():
+    matcher = amie.KeywordMatcher({"negative": ["hate", "sad", "upset", "angry"]}, inflected=("negative",))
+    for text, expected in [
+        ("she hated it", ["hate"]),
+        ("he hates mondays", ["hate"]),
+        ("so much sadness", ["sad"]),
+        ("that was upsetting", ["upset"]),
+        ("he got angrier", ["angry"]),
+    ]:
+        assert matcher.classify(text)["negative"] == expected, text
+    assert matcher.classify("a hatchet")["negative"] == []
+
+
+def test_uninflected_sets_match_exactly():
+    matcher = amie.KeywordMatcher({"quit": ["i am done", "exit"]}, inflected=())
+    assert matcher.classify("ok I  am   done")["quit"] == ["i am done"]
+    assert matcher.classify("exiting now")["quit"] == []
+    assert matcher.classify("the exits")["quit"] == []
+
+
+def test_shared_matcher_agrees_with_keyword_lists():
+    hits = amie.keyword_matcher.classify("I feel sad and I hate this, goodbye")
+    assert hits["negative"] == ["sad", "hate"]
+    assert hits["quit"] == ["goodbye"]
@@ -0,0 +1,79 @@
+import pytest
+
+import Empathy13 as amie
+
+
+def capture(captured=0, buffered=10, playback_end=0):
+    """A capture whose ring buffer holds the last `buffered` of `captured` chunks."""
+    mic = amie.MicrophoneCapture(device_factory=None)
+    mic.sample_rate = 1000
+    mic.sample_width = 2
+    mic.chunk_size = 100  # 0.1 s per chunk
+    mic.running = True
+    for seq in range(max(0, captured - buffered), captured):
+        mic.chunks.append(bytes([seq % 256]) * 200)
+    mic.next_seq = captured
+    mic.playback_end_seq = playback_end
+    return mic
+
+
+def test_read_returns_chunks_in_order():
+    mic = capture(captured=5)
+    assert mic.read(3) == (bytes([3]) * 200, 4)
+
+
+def test_reader_behind_the_ring_buffer_skips_ahead():
+    mic = capture(captured=20, buffered=10)
+    chunk, next_seq = mic.read(2)
+    assert chunk == bytes([10]) * 200
+    assert next_seq == 11
+    assert mic.overruns == 1
+
+
+def test_read_raises_once_the_capture_thread_died():
+    mic = capture(captured=5)
+    mic.error = OSError("device unplugged")
+    with pytest.raises(RuntimeError, match="device unplugged"):
+        mic.read(5)
+    mic.error = None
+    mic.running = False
+    assert mic.read(5) == (b"", 5)
+
+
+def test_source_starts_preroll_seconds_back():
+    mic = capture(captured=50, buffered=50)
+    with amie.BufferedMicrophoneSource(mic, preroll=0.5) as source:
+        assert source.stream.seq == 45
+        assert mic.readers == 1
+    assert mic.readers == 0
+
+
+def test_source_never_starts_inside_amies_last_utterance():
+    mic = capture(captured=50, buffered=50, playback_end=48)
+    with amie.BufferedMicrophoneSource(mic, preroll=0.5) as source:
+        assert source.stream.seq == 48
+
+
+def test_catch_up_resumes_after_playback_ended():
+    mic = capture(captured=50, buffered=50)
+    with amie.BufferedMicrophoneSource(mic, preroll=0.5) as source:
+        source.stream.pending = b"stale"
+        # Amie spoke while chunks 50..59 were captured
+        for seq in range(50, 60):
+            mic.chunks.append(bytes([seq]) * 200)
+        mic.next_seq = 60
+        mic.playback_end_seq = 60
+        for seq in range(60, 62):
+            mic.chunks.append(bytes([seq]) * 200)
+        mic.next_seq = 62
+        source.catch_up()
+        assert source.stream.seq == 60
+        assert source.stream.pending == b""
+        assert source.stream.read(100) == bytes([60]) * 200
+
+
+def test_catch_up_never_moves_backwards():
+    mic = capture(captured=50, buffered=50, playback_end=10)
+    with amie.BufferedMicrophoneSource(mic, preroll=0.5) as source:
+        source.catch_up()
+        assert source.stream.seq == 45
@@ -0,0 +1,43 @@
+import random
+
+import Empathy13 as amie
+
+
+def sampler(prompts, seed=0):
+    catalog = amie.SELPromptCatalog()
+    catalog.add("child", "general", prompts)
+    return amie.PromptSampler(catalog, rng=random.Random(seed))
+
+
+def test_no_repeats_until_the_bag_is_exhausted():
+    prompts = ["p%d" % i for i in range(7)]
+    bag = sampler(prompts)
+    for _ in range(5):
+        assert sorted(bag.draw("child", "general") for _ in prompts) == prompts
+
+
+def test_last_prompt_is_not_repeated_across_rounds():
+    prompts = ["a", "b", "c"]
+    for seed in range(50):
+        bag = sampler(prompts, seed)
+        draws = [bag.draw("child", "general") for _ in range(30)]
+        assert all(first != second for first, second in zip(draws, draws[1:])), seed
+
+
+def test_refill_false_returns_none_once_exhausted():
+    bag = sampler(["a", "b"])
+    assert {bag.draw("child", "general", refill=False) for _ in range(2)} == {"a", "b"}
+    assert bag.draw("child", "general", refill=False) is None
+
+
+def test_exclude_skips_prompts():
+    bag = sampler(["a", "b", "c"])
+    draws = [bag.draw("child", "general", exclude={"b"}) for _ in range(6)]
+    assert "b" not in draws
+    assert bag.draw("child", "general", exclude={"a", "b", "c"}) is None
+
+
+def test_unknown_band_or_category_returns_none():
+    bag = sampler(["a"])
+    assert bag.draw("teen", "general") is None
+    assert bag.draw("child", "missing") is None
@@ -0,0 +1,63 @@
+import pytest
+
+import Empathy13 as amie
+
+
+@pytest.mark.parametrize("body, message", [
+    ({"name": 42}, "name must be a string"),
+    ({"age": "ten"}, "age must be an integer"),
+    ({"age": 4}, "age must be between 5 and 50"),
+    ({"age": 51}, "age must be between 5 and 50"),
+    ({"feedback": {"rating": "great"}}, "feedback rating must be an integer"),
+    ({"feedback": {"rating": 0}}, "feedback rating must be between 1 and 5"),
+    ({"feedback": {"rating": 6}}, "feedback rating must be between 1 and 5"),
+])
+def test_invalid_fields_are_rejected(body, message):
+    with pytest.raises(ValueError, match=message):
+        amie.parse_session_fields(body)
+
+
+def test_query_string_values_are_coerced():
+    fields = amie.parse_session_fields({"name": "Ana", "age": "12", "feedback": {"rating": "4", "comment": "ok"}})
+    assert fields == {"name": "Ana", "age": 12, "feedback": {"rating": 4, "comment": "ok"}}
+
+
+def test_empty_fields_are_ignored():
+    assert amie.parse_session_fields({"name": "", "feedback": {"comment": "no rating"}}) == {
+        "name": None, "age": None, "feedback": None,
+    }
+
+
+def test_invalid_request_changes_nothing(store):
+    session = amie.Session()
+    with pytest.raises(ValueError):
+        amie.apply_session_fields(session, {"name": "Ana", "age": 99, "goal": "read more"})
+    assert session.profile == {}
+    assert session.pending_goals == []
+    assert store.get("ana") is None
+
+
+def test_profile_and_feedback_are_applied(store):
+    session = amie.Session()
+    amie.apply_session_fields(session, {"name": "Ana", "age": "12", "feedback": {"rating": 5}})
+    assert session.profile == {"name": "Ana", "age": 12}
+    assert session.feedback_count == 1
+    assert session.feedback_total == 5
+    assert store.get("ana")["profile"] == {"name": "Ana", "age": 12}
+    assert store.get_meta("last_user") == "ana"
+
+
+def test_goals_wait_for_a_name_and_never_reach_the_default_profile(store):
+    session = amie.Session()
+    amie.apply_session_fields(session, {"goal": "read more"})
+    amie.apply_session_fields(session, {"goal": "sleep early"})
+    assert [goal["goal"] for goal in session.pending_goals] == ["read more", "sleep early"]
+    assert store.get(amie.DEFAULT_USER_ID) is None
+
+    amie.apply_session_fields(session, {"name": "Ana"})
+    assert session.pending_goals == []
+    assert [goal["goal"] for goal in store.get("ana")["goals"]] == ["read more", "sleep early"]
+    assert store.get(amie.DEFAULT_USER_ID) is None
+
+    amie.apply_session_fields(session, {"goal": "walk daily"})
+    assert [goal["goal"] for goal in store.get("ana")["goals"]][-1] == "walk daily"